@@ -1,148 +1,360 @@
-from parsing_core import create_parsing_step, add_parsing_step_to_list, tokenize_input_string, is_terminal_symbol, is_nonterminal_symbol, TreeNode
+from collections import OrderedDict
+from parsing_core import tokenize_input_string, compile_grammar, StepAction, TracedParser, TRACE_FULL, DEFAULT_STEPS_PER_TOKEN
+from token_stream import open_token_stream, get_token_ids
+from tree_store import create_tree_builder, TREE_OBJECTS
+from grammar_analysis import get_grammar_analysis
 
 
-class BacktrackingParser:
-    def __init__(self, input_grammar):
+# Returned by the engine when a new frame was pushed and its result is not known yet
+PENDING_RESULT = object()
+
+
+class SymbolFrame:
+    __slots__ = ("symbol", "position", "recursion_depth", "productions", "production_index", "memo_key")
+    
+    def __init__(self, symbol, position, recursion_depth, productions, memo_key):
+        self.symbol = symbol
+        self.position = position
+        self.recursion_depth = recursion_depth
+        self.productions = productions
+        self.production_index = 0
+        self.memo_key = memo_key
+
+
+class ProductionFrame:
+    __slots__ = ("production", "position", "recursion_depth", "symbol_index", "children_nodes", "tree_mark")
+    
+    def __init__(self, production, position, recursion_depth, tree_mark):
+        self.production = production
+        self.position = position
+        self.recursion_depth = recursion_depth
+        self.symbol_index = 0
+        self.children_nodes = []
+        self.tree_mark = tree_mark
+
+
+class BacktrackingTraceRenderer:
+    def __init__(self, compiled_grammar, input_tokens):
+        self.compiled_grammar = compiled_grammar
+        self.input_tokens = input_tokens
+    
+    def render_step(self, step):
+        if step.action == StepAction.TRY:
+            return "Trying: " + str(step.production)
+        
+        if step.action == StepAction.BACKTRACK:
+            return "Backtracking from " + str(step.production)
+        
+        if step.action == StepAction.MATCH:
+            if step.production is not None:
+                return "Matched epsilon: " + str(step.production)
+            return "Matched '" + self.compiled_grammar.get_symbol_name(step.symbol_id) + "' at position " + str(step.position)
+        
+        if step.action == StepAction.FAIL:
+            if step.position < len(self.input_tokens):
+                got_token = self.input_tokens[step.position]
+            else:
+                got_token = "end"
+            return "Failed to match '" + self.compiled_grammar.get_symbol_name(step.symbol_id) + "' at position " + str(step.position) + " (got '" + got_token + "')"
+        
+        if step.action == StepAction.MEMO:
+            symbol = self.compiled_grammar.get_symbol_name(step.symbol_id)
+            if step.end_position < 0:
+                return "Reused memo: " + symbol + " fails at position " + str(step.position)
+            return "Reused memo: " + symbol + " matches positions " + str(step.position) + " to " + str(step.end_position)
+        
+        return ""
+
+
+class BacktrackingParser(TracedParser):
+    def __init__(self, input_grammar, packrat=False, memo_limit=None, maximum_depth=None, tree_store=TREE_OBJECTS, lookahead_pruning=False, length_pruning=False, trace_level=TRACE_FULL, maximum_steps=100, steps_per_token=DEFAULT_STEPS_PER_TOKEN, time_limit=None):
         self.grammar = input_grammar
+        self.compiled_grammar = compile_grammar(input_grammar)
         self.input_tokens = []
+        self.input_token_ids = []  # Matched against terminal ids instead of comparing strings
         self.parsing_steps = []
         self.step_counter = 0
-        self.maximum_steps = 100
-        self.maximum_depth = 50
+        self.is_accepted = False
+        self.init_trace_settings(trace_level, maximum_steps, steps_per_token, time_limit)
+        self.maximum_depth = maximum_depth  # None means nesting is only limited by memory
         self.is_too_deep = False
         self.call_stack = []
         self.parse_tree = None  # Root of the parse tree
+        self.trace_renderer = None
+        # TREE_OBJECTS builds TreeNode objects, TREE_ARENA keeps nodes in parallel arrays and
+        # hands out TreeNodeView adapters
+        self.tree_builder = create_tree_builder(self.compiled_grammar, tree_store)
+        
+        # Packrat mode caches (non-terminal, position) outcomes; memo_limit bounds the table (LRU eviction)
+        self.packrat_enabled = packrat
+        self.memo_limit = memo_limit
+        self.memo_table = OrderedDict()
+        self.memo_hits = 0
+        self.memo_misses = 0
+        self.memo_evictions = 0
+        
+        # Lookahead pruning skips alternatives whose FIRST set cannot start with the next token;
+        # a non-terminal with a single viable production is then entered without backtracking
+        self.lookahead_pruning = lookahead_pruning
+        self.analysis = get_grammar_analysis(self.compiled_grammar)
+        self.pruned_alternatives = 0
+        
+        # Length pruning fails a production as soon as the rest of its right side needs more
+        # tokens, or a terminal that no longer appears, in what is left of the input
+        self.length_pruning = length_pruning
+        self.input_terminal_sets = None
+        self.pruned_by_length = 0
+        self.pruned_by_terminals = 0
+    
+    def parse_input(self, input_string, trace_level=None, maximum_steps=None, steps_per_token=None, time_limit=None):
+        return self.parse_tokens(tokenize_input_string(input_string), trace_level, maximum_steps, steps_per_token, time_limit)
+    
+    def parse_file(self, file_path, trace_level=None, maximum_steps=None, steps_per_token=None, time_limit=None, split_on_whitespace=None):
+        # Tokenized like parse_input unless split_on_whitespace says otherwise; see open_token_stream
+        with open_token_stream(file_path, self.compiled_grammar, split_on_whitespace) as token_stream:
+            return self.parse_tokens(token_stream, trace_level, maximum_steps, steps_per_token, time_limit)
     
-    def parse_input(self, input_string):
-        self.input_tokens = tokenize_input_string(input_string)
+    def parse_tokens(self, input_tokens, trace_level=None, maximum_steps=None, steps_per_token=None, time_limit=None):
+        # input_tokens is any sequence of token strings, such as a list or a TokenStream
+        self.input_tokens = input_tokens
+        self.input_token_ids = get_token_ids(input_tokens, self.compiled_grammar)
+        self.trace_renderer = BacktrackingTraceRenderer(self.compiled_grammar, self.input_tokens)
         self.parsing_steps = []
         self.step_counter = 0
+        self.is_accepted = False
         self.is_too_deep = False
+        self.start_budget(len(self.input_tokens), trace_level, maximum_steps, steps_per_token, time_limit)
         self.call_stack = []
         self.parse_tree = None
+        self.tree_builder.reset()
+        self.memo_table = OrderedDict()
+        self.memo_hits = 0
+        self.memo_misses = 0
+        self.memo_evictions = 0
+        self.pruned_alternatives = 0
+        self.pruned_by_length = 0
+        self.pruned_by_terminals = 0
+        self.input_terminal_sets = None
+        if self.length_pruning:
+            self.input_terminal_sets = self.build_input_terminal_sets()
         
         if self.detect_left_recursion():
-            self.add_parsing_step("reject", "LEFT RECURSION ERROR: Grammar contains left recursion - backtracking will loop forever trying the same productions")
+            self.add_result_step("reject", "LEFT RECURSION ERROR: Grammar contains left recursion - backtracking will loop forever trying the same productions (" + self.describe_left_recursion() + ")")
             return self.parsing_steps
         
         # Build the parse tree
-        tree_result = self.match_grammar_symbol(self.grammar.start_symbol, 0, 0)
-        
-        if tree_result is not None:
-            position, tree_node = tree_result
-            if position == len(self.input_tokens):
-                self.parse_tree = tree_node
-                self.add_parsing_step("accept", "Input accepted!")
-            elif self.step_counter >= self.maximum_steps or self.is_too_deep:
-                self.add_parsing_step("reject", "RECURSION DEPTH ERROR: Exceeded step limit - likely caused by left recursion or deep grammar nesting")
-            else:
-                self.add_parsing_step("reject", "Input rejected - no valid parse found")
-        elif self.step_counter >= self.maximum_steps or self.is_too_deep:
-            self.add_parsing_step("reject", "RECURSION DEPTH ERROR: Exceeded step limit - likely caused by left recursion or deep grammar nesting")
+        tree_result = self.match_grammar_symbol(self.compiled_grammar.start_symbol, 0, 0)
+        
+        if tree_result is not None and tree_result[0] == len(self.input_tokens):
+            self.parse_tree = self.tree_builder.get_tree(tree_result[1])
+            self.is_accepted = True
+            self.add_result_step("accept", "Input accepted!")
+        elif self.is_out_of_time:
+            self.add_result_step("reject", self.get_time_limit_message())
+        elif self.is_too_deep:
+            self.add_result_step("reject", "RECURSION DEPTH ERROR: Exceeded maximum depth of " + str(self.maximum_depth) + " - caused by deep grammar nesting")
+        elif self.has_exceeded_budget():
+            self.add_result_step("reject", "STEP LIMIT ERROR: Exceeded step limit of " + str(int(self.step_budget)) + " steps - likely caused by heavy backtracking")
         else:
-            self.add_parsing_step("reject", "Input rejected - no valid parse found")
+            self.add_result_step("reject", "Input rejected - no valid parse found")
         
         return self.parsing_steps
     
+    def get_statistics(self):
+        return {
+            "steps": self.step_counter,
+            "memo_hits": self.memo_hits,
+            "memo_misses": self.memo_misses,
+            "memo_evictions": self.memo_evictions,
+            "pruned_alternatives": self.pruned_alternatives,
+            "pruned_by_length": self.pruned_by_length,
+            "pruned_by_terminals": self.pruned_by_terminals
+        }
+    
     def detect_left_recursion(self):
-        for production in self.grammar.production_list:
-            if len(production.right_side) > 0:
-                first_symbol = production.right_side[0]
-                if first_symbol == production.left_side:
-                    return True
-                
-                visited = set()
-                if self.has_left_recursive_cycle(production.left_side, first_symbol, visited):
-                    return True
-        return False
-    
-    def has_left_recursive_cycle(self, start_symbol, current_symbol, visited):
-        if current_symbol == start_symbol:
-            return True
-        if current_symbol in visited or not is_nonterminal_symbol(current_symbol, self.grammar):
-            return False
-        
-        visited.add(current_symbol)
-        for production in self.grammar.get_productions_for_symbol(current_symbol):
-            if len(production.right_side) > 0:
-                first_symbol = production.right_side[0]
-                if self.has_left_recursive_cycle(start_symbol, first_symbol, visited):
-                    return True
-        visited.remove(current_symbol)
-        return False
+        # Computed once per grammar, and includes recursion hidden behind nullable prefixes
+        return len(self.analysis.get_left_recursive_cycles()) > 0
+    
+    def describe_left_recursion(self):
+        cycle_texts = []
+        for cycle in self.analysis.get_left_recursive_cycles():
+            cycle_texts.append(" -> ".join(cycle))
+        return "; ".join(cycle_texts)
     
     def match_grammar_symbol(self, symbol, position, recursion_depth):
-        if self.step_counter >= self.maximum_steps:
+        # Iterative engine: frames on an explicit stack replace the recursive descent, so nesting
+        # depth is bounded by memory instead of the Python call stack
+        frame_stack = []
+        symbol_result = self.enter_grammar_symbol(symbol, position, recursion_depth, frame_stack)
+        
+        while len(frame_stack) > 0:
+            frame = frame_stack[-1]
+            if type(frame) is ProductionFrame:
+                symbol_result = self.resume_production(frame, symbol_result, frame_stack)
+            else:
+                symbol_result = self.resume_symbol(frame, symbol_result, frame_stack)
+        
+        return symbol_result
+    
+    def enter_grammar_symbol(self, symbol, position, recursion_depth, frame_stack):
+        if self.step_counter >= self.step_limit and self.is_budget_exhausted():
             return None
         
-        if recursion_depth > self.maximum_depth:
+        if self.maximum_depth is not None and recursion_depth > self.maximum_depth:
             self.is_too_deep = True
             return None
         
-        if is_terminal_symbol(symbol, self.grammar):
+        if self.compiled_grammar.is_terminal(symbol):
             return self.match_terminal_symbol(symbol, position)
-        else:
-            return self.try_all_productions(symbol, position, recursion_depth)
-    
-    def match_terminal_symbol(self, terminal, position):
-        if position < len(self.input_tokens) and self.input_tokens[position] == terminal:
-            step_description = "Matched '" + terminal + "' at position " + str(position)
-            self.add_parsing_step("match", step_description)
-            # Create leaf node for terminal
-            leaf_node = TreeNode(terminal)
-            return (position + 1, leaf_node)
-        else:
-            if position < len(self.input_tokens):
-                got_token = self.input_tokens[position]
-            else:
-                got_token = "end"
-            step_description = "Failed to match '" + terminal + "' at position " + str(position) + " (got '" + got_token + "')"
-            self.add_parsing_step("fail", step_description)
-            return None
+        
+        memo_key = None
+        if self.packrat_enabled:
+            memo_key = (symbol, position)
+            if memo_key in self.memo_table:
+                return self.reuse_memoized_result(memo_key)
+            self.memo_misses = self.memo_misses + 1
+        
+        matching_productions = self.compiled_grammar.get_productions_for_symbol(symbol)
+        if self.lookahead_pruning:
+            viable_productions = self.analysis.get_viable_productions(symbol, self.get_token_id(position))
+            self.pruned_alternatives = self.pruned_alternatives + len(matching_productions) - len(viable_productions)
+            matching_productions = viable_productions
+        
+        frame_stack.append(SymbolFrame(symbol, position, recursion_depth, matching_productions, memo_key))
+        return PENDING_RESULT
     
-    def try_all_productions(self, symbol, position, recursion_depth):
-        matching_productions = self.grammar.get_productions_for_symbol(symbol)
+    def resume_symbol(self, frame, production_result, frame_stack):
+        matching_productions = frame.productions
         
-        for i, production in enumerate(matching_productions):
-            step_description = "Trying: " + str(production)
-            self.add_parsing_step("try", step_description)
-            
-            production_result = self.try_single_production(production, position, recursion_depth + 1)
+        while True:
+            if production_result is not PENDING_RESULT:
+                if production_result is not None:
+                    # Success - create node for this non-terminal
+                    position_result, children_nodes = production_result
+                    parent_node = self.tree_builder.make_node(frame.symbol, children_nodes, frame.position, position_result)
+                    return self.finish_symbol(frame, (position_result, parent_node), frame_stack)
+                
+                if self.is_too_deep:
+                    return self.finish_symbol(frame, None, frame_stack)
+                
+                if frame.production_index < len(matching_productions) - 1:
+                    self.add_traced_step("backtrack", production=matching_productions[frame.production_index])
+                frame.production_index = frame.production_index + 1
             
-            if production_result is not None:
-                # Success - create node for this non-terminal
-                position_result, children_nodes = production_result
-                parent_node = TreeNode(symbol, children_nodes)
-                return (position_result, parent_node)
+            if frame.production_index >= len(matching_productions):
+                return self.finish_symbol(frame, None, frame_stack)
             
-            if self.is_too_deep:
-                return None
+            production = matching_productions[frame.production_index]
+            self.add_traced_step("try", production=production)
             
-            if i < len(matching_productions) - 1:
-                step_description = "Backtracking from " + str(production)
-                self.add_parsing_step("backtrack", step_description)
-        
-        return None
+            production_result = self.enter_production(production, frame.position, frame.recursion_depth + 1, frame_stack)
+            if production_result is PENDING_RESULT:
+                return PENDING_RESULT
     
-    def try_single_production(self, production, position, recursion_depth):
-        current_position = position
-        children_nodes = []
+    def finish_symbol(self, frame, symbol_result, frame_stack):
+        frame_stack.pop()
         
+        # Failures caused by the step or depth limits are not real failures, so they are never cached
+        if frame.memo_key is not None:
+            if symbol_result is not None or not (self.is_too_deep or self.has_exceeded_budget()):
+                self.store_memoized_result(frame.memo_key, symbol_result)
+        return symbol_result
+    
+    def enter_production(self, production, position, recursion_depth, frame_stack):
         if len(production.right_side) == 0:
-            step_description = "Matched epsilon: " + str(production)
-            self.add_parsing_step("match", step_description)
+            self.add_traced_step("match", position=position, end_position=position, production=production)
             # Create epsilon node
-            epsilon_node = TreeNode("ε")
+            epsilon_node = self.tree_builder.make_epsilon(position)
             return (position, [epsilon_node])
         
-        for symbol in production.right_side:
-            symbol_result = self.match_grammar_symbol(symbol, current_position, recursion_depth)
-            if symbol_result is None:
-                return None
-            current_position, child_node = symbol_result
-            children_nodes.append(child_node)
+        frame_stack.append(ProductionFrame(production, position, recursion_depth, self.tree_builder.mark()))
+        return PENDING_RESULT
+    
+    def resume_production(self, frame, symbol_result, frame_stack):
+        right_side = frame.production.right_side
         
-        return (current_position, children_nodes)
+        while True:
+            if symbol_result is not PENDING_RESULT:
+                if symbol_result is None:
+                    frame_stack.pop()
+                    # Nodes of a failed alternative are garbage, unless the memo table may still
+                    # hand some of them out
+                    if not self.packrat_enabled:
+                        self.tree_builder.rollback(frame.tree_mark)
+                    return None
+                frame.position, child_node = symbol_result
+                frame.children_nodes.append(child_node)
+                frame.symbol_index = frame.symbol_index + 1
+            
+            if frame.symbol_index == len(right_side):
+                frame_stack.pop()
+                return (frame.position, frame.children_nodes)
+            
+            if self.length_pruning and not self.can_fit_remaining_input(frame):
+                symbol_result = None
+                continue
+            
+            symbol_result = self.enter_grammar_symbol(right_side[frame.symbol_index], frame.position, frame.recursion_depth, frame_stack)
+            if symbol_result is PENDING_RESULT:
+                return PENDING_RESULT
+    
+    def build_input_terminal_sets(self):
+        # Bitset of the terminals in input_tokens[position:] for every position
+        terminal_count = self.compiled_grammar.terminal_count
+        terminal_sets = [0] * (len(self.input_token_ids) + 1)
+        terminal_set = 0
+        for position in range(len(self.input_token_ids) - 1, -1, -1):
+            token_id = self.input_token_ids[position]
+            if 0 <= token_id < terminal_count:
+                terminal_set = terminal_set | (1 << token_id)
+            terminal_sets[position] = terminal_set
+        return terminal_sets
+    
+    def can_fit_remaining_input(self, frame):
+        production_id = self.compiled_grammar.get_production_id(frame.production)
+        minimum_length, required_terminals = self.analysis.get_suffix_bounds(production_id)[frame.symbol_index]
+        
+        if minimum_length > len(self.input_tokens) - frame.position:
+            self.pruned_by_length = self.pruned_by_length + 1
+            return False
+        if required_terminals & ~self.input_terminal_sets[frame.position]:
+            self.pruned_by_terminals = self.pruned_by_terminals + 1
+            return False
+        return True
+    
+    def get_token_id(self, position):
+        if position < len(self.input_token_ids):
+            return self.input_token_ids[position]
+        return self.compiled_grammar.end_marker_id
+    
+    def match_terminal_symbol(self, terminal, position):
+        terminal_id = self.compiled_grammar.symbol_ids[terminal]
+        if position < len(self.input_token_ids) and self.input_token_ids[position] == terminal_id:
+            self.add_traced_step("match", symbol_id=terminal_id, position=position, end_position=position + 1)
+            # Create leaf node for terminal
+            leaf_node = self.tree_builder.make_leaf(terminal, position)
+            return (position + 1, leaf_node)
+        else:
+            self.add_traced_step("fail", symbol_id=terminal_id, position=position)
+            return None
+    
+    def reuse_memoized_result(self, memo_key):
+        self.memo_hits = self.memo_hits + 1
+        self.memo_table.move_to_end(memo_key)
+        symbol_result = self.memo_table[memo_key]
+        
+        symbol, position = memo_key
+        if symbol_result is None:
+            end_position = -1
+        else:
+            end_position = symbol_result[0]
+            symbol_result = (end_position, self.tree_builder.reuse_node(symbol_result[1]))
+        self.add_traced_step("memo", symbol_id=self.compiled_grammar.get_symbol_id(symbol), position=position, end_position=end_position)
+        return symbol_result
     
-    def add_parsing_step(self, action_type, description_text):
-        self.step_counter = add_parsing_step_to_list(self.parsing_steps, self.step_counter, action_type, description_text)
\ No newline at end of file
+    def store_memoized_result(self, memo_key, symbol_result):
+        self.memo_table[memo_key] = symbol_result
+        if self.memo_limit is not None:
+            while len(self.memo_table) > self.memo_limit:
+                self.memo_table.popitem(last=False)
+                self.memo_evictions = self.memo_evictions + 1
\ No newline at end of file
@@ -0,0 +1,195 @@
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from parsing_core import TRACE_SUMMARY, TRACE_NONE
+from grammar_cache import load_grammar_with_cache
+from backtracking_parser import BacktrackingParser
+from operator_precedence_parser import OperatorPrecedenceParser
+
+
+# Set up once per worker process by init_worker
+worker_state = {}
+
+PARSER_NAMES = ("backtracking", "precedence")
+
+
+def create_parser(grammar, parser_name, parser_options):
+    if parser_name == "backtracking":
+        return BacktrackingParser(grammar, packrat=parser_options["packrat"], lookahead_pruning=parser_options["lookahead_pruning"], length_pruning=parser_options["length_pruning"])
+    return OperatorPrecedenceParser(grammar, use_precedence_functions=parser_options["precedence_functions"])
+
+
+def init_worker(grammar_text, cache_directory, parser_name, parser_options, parse_options):
+    # The parent has already filled the grammar cache, so this is a file load
+    grammar = load_grammar_with_cache(grammar_text, cache_directory)
+    worker_state["parser"] = create_parser(grammar, parser_name, parser_options)
+    worker_state["parse_options"] = parse_options
+    worker_state["include_input"] = parser_options["include_input"]
+
+
+def parse_chunk(numbered_lines):
+    # One JSON line per input, serialized here so the parent only writes text
+    parser = worker_state["parser"]
+    parse_options = worker_state["parse_options"]
+    result_lines = []
+    accepted_count = 0
+    
+    for line_number, input_string in numbered_lines:
+        parse_result = {"line": line_number}
+        if worker_state["include_input"]:
+            parse_result["input"] = input_string
+        
+        start_time = time.perf_counter()
+        try:
+            parsing_steps = parser.parse_input(input_string, **parse_options)
+        except Exception as error:
+            parse_result["accepted"] = False
+            parse_result["error"] = str(error)
+        else:
+            parse_result["accepted"] = parser.is_accepted
+            parse_result["steps"] = parser.step_counter
+            if len(parsing_steps) > 0:
+                parse_result["message"] = parsing_steps[-1].description
+        parse_result["seconds"] = round(time.perf_counter() - start_time, 6)
+        
+        if parse_result["accepted"]:
+            accepted_count = accepted_count + 1
+        result_lines.append(json.dumps(parse_result, ensure_ascii=False))
+    
+    return (len(result_lines), accepted_count, "\n".join(result_lines) + "\n")
+
+
+def read_chunks(input_file, chunk_size, chunk_slots=None):
+    # Lines without their line break, numbered from 1. With chunk_slots the generator waits for a
+    # free slot before each chunk, which keeps the pool from reading the whole input ahead.
+    numbered_lines = []
+    for line_index, line in enumerate(input_file):
+        numbered_lines.append((line_index + 1, line.rstrip("\r\n")))
+        if len(numbered_lines) == chunk_size:
+            if chunk_slots is not None:
+                chunk_slots.acquire()
+            yield numbered_lines
+            numbered_lines = []
+    
+    if len(numbered_lines) > 0:
+        if chunk_slots is not None:
+            chunk_slots.acquire()
+        yield numbered_lines
+
+
+def run_batch(input_file, output_file, grammar_text, cache_directory, parser_name, parser_options, parse_options, job_count, chunk_size, is_unordered):
+    # Returns (input count, accepted count)
+    input_count = 0
+    accepted_count = 0
+    
+    if job_count == 1:
+        init_worker(grammar_text, cache_directory, parser_name, parser_options, parse_options)
+        for numbered_lines in read_chunks(input_file, chunk_size):
+            chunk_count, chunk_accepted, result_text = parse_chunk(numbered_lines)
+            output_file.write(result_text)
+            input_count = input_count + chunk_count
+            accepted_count = accepted_count + chunk_accepted
+        return (input_count, accepted_count)
+    
+    # A few chunks per worker in flight: enough to keep every core busy, and in ordered mode a
+    # slow chunk only holds back that many finished ones
+    chunk_slots = threading.Semaphore(job_count * 4)
+    with multiprocessing.Pool(job_count, initializer=init_worker, initargs=(grammar_text, cache_directory, parser_name, parser_options, parse_options)) as worker_pool:
+        chunks = read_chunks(input_file, chunk_size, chunk_slots)
+        if is_unordered:
+            chunk_results = worker_pool.imap_unordered(parse_chunk, chunks)
+        else:
+            chunk_results = worker_pool.imap(parse_chunk, chunks)
+        
+        for chunk_count, chunk_accepted, result_text in chunk_results:
+            chunk_slots.release()
+            output_file.write(result_text)
+            input_count = input_count + chunk_count
+            accepted_count = accepted_count + chunk_accepted
+    return (input_count, accepted_count)
+
+
+def build_argument_parser():
+    argument_parser = argparse.ArgumentParser(description="Parse every line of a file (or stdin) with one grammar and write one JSON result per line.")
+    argument_parser.add_argument("input", nargs="?", default="-", help="input file with one input per line, '-' for stdin (default)")
+    argument_parser.add_argument("--grammar", required=True, help="grammar file in the GUI's rule format")
+    argument_parser.add_argument("--cache-dir", default=None, help="directory for the parsed grammar cache, private to this user (default: the per-user cache directory)")
+    argument_parser.add_argument("--parser", choices=PARSER_NAMES, default="backtracking", help="parsing method (default: backtracking)")
+    argument_parser.add_argument("--output", default="-", help="JSONL output file, '-' for stdout (default)")
+    argument_parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1, help="worker processes (default: one per CPU)")
+    argument_parser.add_argument("--chunk-size", type=int, default=256, help="inputs sent to a worker at a time (default: 256)")
+    argument_parser.add_argument("--unordered", action="store_true", help="write results as chunks finish instead of in input order")
+    argument_parser.add_argument("--trace", choices=(TRACE_SUMMARY, TRACE_NONE), default=TRACE_SUMMARY, help="'summary' adds the result message, 'none' only counts steps")
+    argument_parser.add_argument("--maximum-steps", type=float, default=math.inf, help="step limit per input (default: none)")
+    argument_parser.add_argument("--steps-per-token", type=int, default=None, help="step limit that grows with the input length")
+    argument_parser.add_argument("--time-limit", type=float, default=None, help="seconds allowed per input")
+    argument_parser.add_argument("--packrat", action="store_true", help="backtracking: memoize non-terminal results")
+    argument_parser.add_argument("--lookahead-pruning", action="store_true", help="backtracking: skip alternatives by FIRST set")
+    argument_parser.add_argument("--length-pruning", action="store_true", help="backtracking: cut branches that cannot fit the rest of the input")
+    argument_parser.add_argument("--precedence-functions", action="store_true", help="precedence: also derive f/g precedence functions; relations are still read from the full table")
+    argument_parser.add_argument("--include-input", action="store_true", help="copy each input into its result")
+    return argument_parser
+
+
+def main(argument_list=None):
+    arguments = build_argument_parser().parse_args(argument_list)
+    if arguments.jobs < 1 or arguments.chunk_size < 1:
+        print("--jobs and --chunk-size must be at least 1", file=sys.stderr)
+        return 2
+    
+    with open(arguments.grammar, encoding="utf-8") as grammar_file:
+        grammar_text = grammar_file.read()
+    try:
+        # Parsed once here; workers load the cached result
+        load_grammar_with_cache(grammar_text, arguments.cache_dir)
+    except Exception as error:
+        print("Grammar error: " + str(error), file=sys.stderr)
+        return 2
+    
+    parser_options = {
+        "packrat": arguments.packrat,
+        "lookahead_pruning": arguments.lookahead_pruning,
+        "length_pruning": arguments.length_pruning,
+        "precedence_functions": arguments.precedence_functions,
+        "include_input": arguments.include_input
+    }
+    parse_options = {
+        "trace_level": arguments.trace,
+        "maximum_steps": arguments.maximum_steps,
+        "steps_per_token": arguments.steps_per_token,
+        "time_limit": arguments.time_limit
+    }
+    if arguments.parser == "precedence":
+        # Results carry no tree, so the precedence parser can skip building one
+        parse_options["build_tree"] = False
+    
+    if arguments.input == "-":
+        input_file = sys.stdin
+    else:
+        input_file = open(arguments.input, encoding="utf-8")
+    if arguments.output == "-":
+        output_file = sys.stdout
+    else:
+        output_file = open(arguments.output, "w", encoding="utf-8")
+    
+    start_time = time.perf_counter()
+    try:
+        input_count, accepted_count = run_batch(input_file, output_file, grammar_text, arguments.cache_dir, arguments.parser, parser_options, parse_options, arguments.jobs, arguments.chunk_size, arguments.unordered)
+    finally:
+        if input_file is not sys.stdin:
+            input_file.close()
+        if output_file is not sys.stdout:
+            output_file.close()
+    
+    elapsed_seconds = time.perf_counter() - start_time
+    print(str(input_count) + " inputs, " + str(accepted_count) + " accepted, " + str(input_count - accepted_count) + " rejected in " + str(round(elapsed_seconds, 3)) + " s", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
\ No newline at end of file
@@ -0,0 +1,402 @@
+import importlib.util
+import math
+import os
+import sys
+import tempfile
+import threading
+import types
+from parsing_core import tokenize_input_string, compile_grammar, TracedParser, TRACE_FULL
+from grammar_analysis import get_grammar_analysis
+from grammar_cache import get_user_cache_directory, prepare_private_directory, open_private_file
+from token_stream import open_token_stream, TokenStream
+
+
+# Bump when the generated code changes, so modules cached by an older version are not reused
+GENERATOR_VERSION = 2
+
+# Productions with longer right sides get a function of their own instead of nesting that deep
+MAXIMUM_INLINE_LENGTH = 40
+
+# content hash -> loaded module, so every parser for one grammar shares one module
+loaded_modules = {}
+
+# C stack for the thread that parses input nested deeper than the recursion limit allows
+DEEP_PARSE_STACK_SIZE = 256 * 1024 * 1024
+
+# The recursion limit and the thread stack size are process-wide, and run_deep_parse changes
+# them. Every descent parse holds this lock, so two deep parses cannot restore each other's
+# values out of order, and no parse on a normal-sized stack runs under another's raised limit.
+# Parses hold the GIL anyway, so this costs no parallelism. Threads that are not parsing still
+# see the raised limit while a deep parse runs.
+parse_lock = threading.Lock()
+
+
+def get_default_cache_directory():
+    return get_user_cache_directory("descent_parsers")
+
+
+def generate_descent_source(grammar):
+    # One function per non-terminal and one per production, working on integer token ids. The
+    # functions are ordered choice exactly like BacktrackingParser: the first production that
+    # matches wins, and a non-terminal that matched is never re-entered for another alternative
+    compiled_grammar = compile_grammar(grammar)
+    analysis = get_grammar_analysis(compiled_grammar)
+    left_recursive_cycles = analysis.get_left_recursive_cycles()
+    if len(left_recursive_cycles) > 0:
+        cycle_text = "; ".join([" -> ".join(cycle) for cycle in left_recursive_cycles])
+        raise Exception("Grammar contains left recursion, recursive descent would loop forever (" + cycle_text + ")")
+    
+    analysis.get_first_sets()
+    # Non-terminals are numbered in grammar order; this also covers left sides that were never
+    # declared as non-terminals
+    function_names = {}
+    for nonterminal in compiled_grammar.productions_by_symbol:
+        if not compiled_grammar.is_terminal(nonterminal):
+            function_names[nonterminal] = "parse_symbol_" + str(len(function_names))
+    
+    source_lines = [
+        "# Recursive-descent parser generated by descent_compiler, do not edit",
+        "# Grammar " + compiled_grammar.content_hash,
+        "from parsing_core import TreeNode",
+        "",
+        "",
+        "def parse_token_ids(token_ids):",
+        "    # token_ids ends with the end marker id, so reading one past the last token stays in range",
+    ]
+    
+    for nonterminal in function_names:
+        source_lines.append("    ")
+        source_lines.extend(generate_symbol_function(compiled_grammar, analysis, function_names, nonterminal))
+        
+        for production in compiled_grammar.get_productions_for_symbol(nonterminal):
+            if len(production.right_side) > MAXIMUM_INLINE_LENGTH:
+                source_lines.append("    ")
+                source_lines.extend(generate_production_function(compiled_grammar, function_names, production))
+    
+    source_lines.append("    ")
+    start_symbol = compiled_grammar.start_symbol
+    if start_symbol in function_names:
+        source_lines.append("    return " + function_names[start_symbol] + "(0)")
+    else:
+        source_lines.append("    return None")
+    return "\n".join(source_lines) + "\n"
+
+
+def generate_symbol_function(compiled_grammar, analysis, function_names, nonterminal):
+    function_lines = [
+        "    def " + function_names[nonterminal] + "(position):",
+        "        # " + nonterminal,
+        "        token_id = token_ids[position]",
+    ]
+    
+    productions = compiled_grammar.get_productions_for_symbol(nonterminal)
+    group_start = 0
+    while group_start < len(productions):
+        # Neighbouring productions that start with the same symbol share the code for it, so that
+        # symbol is parsed once for all of them; in A -> B c | B the second alternative reuses the
+        # B the first one matched. The result is the same as parsing it again, because a symbol
+        # matched at a position always gives the same result there
+        first_symbol = None
+        if len(productions[group_start].right_side) > 0:
+            first_symbol = productions[group_start].right_side[0]
+        group_end = group_start + 1
+        while group_end < len(productions) and first_symbol is not None and productions[group_end].right_side[:1] == [first_symbol]:
+            group_end = group_end + 1
+        group = productions[group_start:group_end]
+        group_start = group_end
+        
+        if first_symbol is None:
+            function_lines.append("        return (position, TreeNode(" + repr(nonterminal) + ", [TreeNode(\"ε\")]))")
+            return function_lines
+        
+        # A group that needs a first token it cannot start with is not tried at all
+        first_set = 0
+        is_nullable = False
+        for production in group:
+            production_first_set, production_is_nullable = analysis.production_first_sets[compiled_grammar.get_production_id(production)]
+            first_set = first_set | production_first_set
+            is_nullable = is_nullable or production_is_nullable
+        
+        indent = "        "
+        for production in group:
+            function_lines.append(indent + "# " + str(production))
+        if not is_nullable:
+            first_ids = []
+            for terminal_id in range(compiled_grammar.terminal_count):
+                if first_set & (1 << terminal_id):
+                    first_ids.append(str(terminal_id))
+            if len(first_ids) == 0:
+                continue
+            if len(first_ids) == 1:
+                function_lines.append(indent + "if token_id == " + first_ids[0] + ":")
+            else:
+                function_lines.append(indent + "if token_id in {" + ", ".join(first_ids) + "}:")
+            indent = indent + "    "
+        
+        is_long_group = False
+        for production in group:
+            if len(production.right_side) > MAXIMUM_INLINE_LENGTH:
+                is_long_group = True
+        
+        if not is_long_group:
+            function_lines.extend(generate_alternatives(compiled_grammar, function_names, group, indent, 0, [], "position"))
+            continue
+        
+        # Nesting that deep would run into Python's indentation limit
+        for production in group:
+            if len(production.right_side) > MAXIMUM_INLINE_LENGTH:
+                production_id = compiled_grammar.get_production_id(production)
+                function_lines.append(indent + "result = parse_production_" + str(production_id) + "(position)")
+                function_lines.append(indent + "if result is not None:")
+                function_lines.append(indent + "    return result")
+            else:
+                function_lines.extend(generate_production_body(compiled_grammar, function_names, production, indent, 0, [], "position"))
+    
+    function_lines.append("        return None")
+    return function_lines
+
+
+def generate_production_function(compiled_grammar, function_names, production):
+    function_lines = [
+        "    def parse_production_" + str(compiled_grammar.get_production_id(production)) + "(position):",
+        "        # " + str(production),
+    ]
+    function_lines.extend(generate_production_body(compiled_grammar, function_names, production, "        ", 0, [], "position"))
+    function_lines.append("        return None")
+    return function_lines
+
+
+def generate_alternatives(compiled_grammar, function_names, productions, indent, symbol_index, child_expressions, current_position):
+    # productions agree on their first symbol_index symbols, which are already matched. The ones
+    # that also agree on the next symbol match it once in a shared if and continue inside it
+    body_lines = []
+    alternative_index = 0
+    while alternative_index < len(productions):
+        right_side = productions[alternative_index].right_side
+        if symbol_index == len(right_side):
+            # Ordered choice: a finished alternative wins, the ones after it are never tried
+            body_lines.append(indent + "return (" + current_position + ", TreeNode(" + repr(productions[alternative_index].left_side) + ", [" + ", ".join(child_expressions) + "]))")
+            return body_lines
+        
+        symbol = right_side[symbol_index]
+        group_end = alternative_index + 1
+        while group_end < len(productions) and productions[group_end].right_side[symbol_index:symbol_index + 1] == [symbol]:
+            group_end = group_end + 1
+        
+        if group_end - alternative_index == 1:
+            body_lines.extend(generate_production_body(compiled_grammar, function_names, productions[alternative_index], indent, symbol_index, child_expressions, current_position))
+        else:
+            symbol_lines, symbol_indent, next_position, child_expression = generate_symbol_match(compiled_grammar, function_names, symbol, symbol_index, indent, current_position)
+            if symbol_lines is not None:
+                body_lines.extend(symbol_lines)
+                body_lines.extend(generate_alternatives(compiled_grammar, function_names, productions[alternative_index:group_end], symbol_indent, symbol_index + 1, child_expressions + [child_expression], next_position))
+        alternative_index = group_end
+    return body_lines
+
+
+def generate_symbol_match(compiled_grammar, function_names, symbol, symbol_index, indent, current_position):
+    # Returns (lines, indent inside them, position after the symbol, child expression), or Nones
+    # for a symbol without productions, which never matches
+    next_position = "position_" + str(symbol_index + 1)
+    if compiled_grammar.is_terminal(symbol):
+        symbol_lines = [
+            indent + "if token_ids[" + current_position + "] == " + str(compiled_grammar.get_symbol_id(symbol)) + ":",
+            indent + "    " + next_position + " = " + current_position + " + 1",
+        ]
+        return (symbol_lines, indent + "    ", next_position, "TreeNode(" + repr(symbol) + ")")
+    
+    if symbol not in function_names:
+        return (None, None, None, None)
+    
+    child_name = "child_" + str(symbol_index)
+    symbol_lines = [
+        indent + "result = " + function_names[symbol] + "(" + current_position + ")",
+        indent + "if result is not None:",
+        indent + "    " + next_position + ", " + child_name + " = result",
+    ]
+    return (symbol_lines, indent + "    ", next_position, child_name)
+
+
+def generate_production_body(compiled_grammar, function_names, production, indent, symbol_index, child_expressions, current_position):
+    # One nested if per non-terminal and per run of terminals from right_side[symbol_index:] on;
+    # falling out of them means the production failed. Terminal leaves are only created once the
+    # whole right side matched. position_<i> is the position after the first i symbols
+    body_lines = []
+    child_expressions = list(child_expressions)
+    right_side = production.right_side
+    
+    while symbol_index < len(right_side):
+        symbol = right_side[symbol_index]
+        
+        if compiled_grammar.is_terminal(symbol):
+            # The end marker after the last token fails the first comparison, so the ones after
+            # it never read past the end
+            comparisons = []
+            while symbol_index < len(right_side) and compiled_grammar.is_terminal(right_side[symbol_index]):
+                terminal = right_side[symbol_index]
+                token_position = current_position
+                if len(comparisons) > 0:
+                    token_position = current_position + " + " + str(len(comparisons))
+                comparisons.append("token_ids[" + token_position + "] == " + str(compiled_grammar.get_symbol_id(terminal)))
+                child_expressions.append("TreeNode(" + repr(terminal) + ")")
+                symbol_index = symbol_index + 1
+            
+            body_lines.append(indent + "if " + " and ".join(comparisons) + ":")
+            indent = indent + "    "
+            next_position = "position_" + str(symbol_index)
+            body_lines.append(indent + next_position + " = " + current_position + " + " + str(len(comparisons)))
+            current_position = next_position
+            continue
+        
+        symbol_lines, indent, current_position, child_expression = generate_symbol_match(compiled_grammar, function_names, symbol, symbol_index, indent, current_position)
+        if symbol_lines is None:
+            return []
+        body_lines.extend(symbol_lines)
+        child_expressions.append(child_expression)
+        symbol_index = symbol_index + 1
+    
+    body_lines.append(indent + "return (" + current_position + ", TreeNode(" + repr(production.left_side) + ", [" + ", ".join(child_expressions) + "]))")
+    return body_lines
+
+
+def load_descent_module(grammar, cache_directory=None):
+    # Generated modules are cached on disk by grammar hash, so a grammar is only compiled once
+    # per user; a module file is written under a temporary name and moved into place. The files
+    # are executed, so as with the grammar cache only a directory private to this user is used,
+    # and a module whose file someone else owns or can write to is generated again. Without
+    # such a directory the module is built in memory.
+    compiled_grammar = compile_grammar(grammar)
+    content_hash = compiled_grammar.content_hash
+    if content_hash in loaded_modules:
+        return loaded_modules[content_hash]
+    
+    if cache_directory is None:
+        cache_directory = get_default_cache_directory()
+    module_name = "descent_v" + str(GENERATOR_VERSION) + "_" + content_hash
+    module_path = os.path.join(cache_directory, module_name + ".py")
+    
+    if not prepare_private_directory(cache_directory):
+        descent_module = types.ModuleType(module_name)
+        exec(compile(generate_descent_source(compiled_grammar), module_name, "exec"), descent_module.__dict__)
+        loaded_modules[content_hash] = descent_module
+        return descent_module
+    
+    module_file = open_private_file(module_path, "rb")
+    if module_file is not None:
+        module_file.close()
+    else:
+        source_text = generate_descent_source(compiled_grammar)
+        file_handle, temporary_path = tempfile.mkstemp(suffix=".py", dir=cache_directory)
+        with os.fdopen(file_handle, "w", encoding="utf-8") as module_file:
+            module_file.write(source_text)
+        os.replace(temporary_path, module_path)
+    
+    module_spec = importlib.util.spec_from_file_location(module_name, module_path)
+    descent_module = importlib.util.module_from_spec(module_spec)
+    module_spec.loader.exec_module(descent_module)
+    
+    loaded_modules[content_hash] = descent_module
+    return descent_module
+
+
+def run_deep_parse(descent_module, token_ids, recursion_limit):
+    # Runs the generated parser on a thread with a large stack and the recursion limit raised to
+    # recursion_limit; errors raised on the thread are raised again here. Callers hold parse_lock.
+    thread_result = {}
+    
+    def run_parse():
+        try:
+            thread_result["parse_result"] = descent_module.parse_token_ids(token_ids)
+        except Exception as error:
+            thread_result["error"] = error
+    
+    previous_limit = sys.getrecursionlimit()
+    previous_stack_size = threading.stack_size()
+    try:
+        threading.stack_size(DEEP_PARSE_STACK_SIZE)
+    except ValueError:
+        pass
+    sys.setrecursionlimit(max(previous_limit, recursion_limit))
+    try:
+        parse_thread = threading.Thread(target=run_parse)
+        try:
+            parse_thread.start()
+        finally:
+            threading.stack_size(previous_stack_size)
+        parse_thread.join()
+    finally:
+        sys.setrecursionlimit(previous_limit)
+    
+    if "error" in thread_result:
+        raise thread_result["error"]
+    return thread_result["parse_result"]
+
+
+class DescentParser(TracedParser):
+    # Runs the generated module for a grammar; accepts the same inputs and builds the same trees
+    # as BacktrackingParser without a step limit, but records only the result step
+    def __init__(self, input_grammar, cache_directory=None, trace_level=TRACE_FULL):
+        self.grammar = input_grammar
+        self.compiled_grammar = compile_grammar(input_grammar)
+        self.descent_module = load_descent_module(self.compiled_grammar, cache_directory)
+        # Without left recursion no generated function is entered twice at one position, so a
+        # parse never nests deeper than this many calls per token
+        self.calls_per_position = len(self.compiled_grammar.productions_by_symbol) + self.compiled_grammar.production_count
+        self.terminal_ids = {}
+        for terminal in self.compiled_grammar.terminal_symbols:
+            self.terminal_ids.setdefault(terminal, self.compiled_grammar.get_symbol_id(terminal))
+        self.input_tokens = []
+        self.parsing_steps = []
+        self.step_counter = 0
+        self.is_accepted = False
+        self.parse_tree = None
+        self.trace_renderer = None
+        self.init_trace_settings(trace_level, math.inf, None, None)
+    
+    def parse_input(self, input_string, trace_level=None):
+        return self.parse_tokens(tokenize_input_string(input_string), trace_level)
+    
+    def parse_file(self, file_path, trace_level=None, split_on_whitespace=None):
+        # Tokenized like parse_input unless split_on_whitespace says otherwise; see open_token_stream
+        with open_token_stream(file_path, self.compiled_grammar, split_on_whitespace) as token_stream:
+            return self.parse_tokens(token_stream, trace_level)
+    
+    def parse_tokens(self, input_tokens, trace_level=None):
+        self.input_tokens = input_tokens
+        self.parsing_steps = []
+        self.step_counter = 0
+        self.is_accepted = False
+        self.parse_tree = None
+        self.start_budget(len(input_tokens), trace_level)
+        
+        token_ids = self.get_token_ids(input_tokens)
+        with parse_lock:
+            try:
+                parse_result = self.descent_module.parse_token_ids(token_ids)
+            except RecursionError:
+                # Deeply nested input is parsed again on a thread with room for the deepest possible
+                # nesting, so it gets the same result as with BacktrackingParser
+                recursion_limit = min(sys.getrecursionlimit() + self.calls_per_position * len(token_ids), 2 ** 31 - 1)
+                try:
+                    parse_result = run_deep_parse(self.descent_module, token_ids, recursion_limit)
+                except (RecursionError, MemoryError):
+                    self.add_result_step("reject", "RECURSION DEPTH ERROR: Input nests deeper than the Python call stack allows")
+                    return self.parsing_steps
+        
+        if parse_result is not None and parse_result[0] == len(input_tokens):
+            self.parse_tree = parse_result[1]
+            self.is_accepted = True
+            self.add_result_step("accept", "Input accepted!")
+        else:
+            self.add_result_step("reject", "Input rejected - no valid parse found")
+        return self.parsing_steps
+    
+    def get_token_ids(self, input_tokens):
+        # Terminal ids, -1 for anything else, and the end marker id after the last token
+        if isinstance(input_tokens, TokenStream) and input_tokens.compiled_grammar is self.compiled_grammar:
+            token_ids = input_tokens.token_ids.tolist()
+        else:
+            terminal_ids = self.terminal_ids
+            token_ids = [terminal_ids.get(token, -1) for token in input_tokens]
+        token_ids.append(self.compiled_grammar.end_marker_id)
+        return token_ids
\ No newline at end of file
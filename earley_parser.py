@@ -0,0 +1,285 @@
+import math
+from parsing_core import tokenize_input_string, compile_grammar, StepAction, TreeNode, TracedParser, TRACE_FULL
+from grammar_analysis import get_grammar_analysis
+from token_stream import open_token_stream, get_token_ids
+
+
+class EarleyTraceRenderer:
+    def __init__(self, input_tokens, earley_sets):
+        self.input_tokens = input_tokens
+        self.earley_sets = earley_sets
+    
+    def render_step(self, step):
+        if step.action == StepAction.SCAN:
+            earley_set = self.earley_sets[step.position]
+            scanned_count = self.earley_sets[step.position + 1].scanned_count
+            return "Set " + str(step.position) + ": " + str(len(earley_set.items)) + " items (" + str(earley_set.predicted_count) + " predicted, " + str(earley_set.completed_count) + " completed), scanned '" + self.input_tokens[step.position] + "' into " + str(scanned_count) + " items"
+        return ""
+
+
+class EarleySet:
+    def __init__(self):
+        # item (production_index, dot, origin) -> start of the symbol before the dot when the item
+        # was first added, None for predicted items
+        self.back_pointers = {}
+        self.items = []
+        self.waiting_items = {}
+        self.first_completions = {}
+        # symbol -> (topmost item, back pointer) of its Leo chain, None when it has no chain
+        self.leo_items = {}
+        # topmost item added by a Leo completion -> (symbol, origin) of the completion that added it
+        self.leo_sources = {}
+        self.predicted_count = 0
+        self.completed_count = 0
+        self.scanned_count = 0
+    
+    def add_item(self, item, back_pointer):
+        if item in self.back_pointers:
+            return False
+        self.back_pointers[item] = back_pointer
+        self.items.append(item)
+        return True
+
+
+class EarleyParser(TracedParser):
+    def __init__(self, input_grammar, trace_level=TRACE_FULL):
+        self.grammar = input_grammar
+        self.compiled_grammar = compile_grammar(input_grammar)
+        self.analysis = get_grammar_analysis(input_grammar)
+        self.input_tokens = []
+        self.input_token_ids = []
+        self.parsing_steps = []
+        self.step_counter = 0
+        self.earley_sets = []
+        self.parse_tree = None
+        self.is_accepted = False
+        self.trace_renderer = None
+        # Earley parsing always terminates, so only the trace level is configurable
+        self.init_trace_settings(trace_level, math.inf, None, None)
+        
+        self.production_ids_by_symbol = {}
+        for production_id, production in enumerate(self.compiled_grammar.production_list):
+            self.production_ids_by_symbol.setdefault(production.left_side, []).append(production_id)
+    
+    def parse_input(self, input_string, trace_level=None):
+        return self.parse_tokens(tokenize_input_string(input_string), trace_level)
+    
+    def parse_file(self, file_path, trace_level=None, split_on_whitespace=None):
+        # Tokenized like parse_input unless split_on_whitespace says otherwise; see open_token_stream
+        with open_token_stream(file_path, self.compiled_grammar, split_on_whitespace) as token_stream:
+            return self.parse_tokens(token_stream, trace_level)
+    
+    def parse_tokens(self, input_tokens, trace_level=None):
+        self.input_tokens = input_tokens
+        self.input_token_ids = get_token_ids(input_tokens, self.compiled_grammar)
+        self.parsing_steps = []
+        self.step_counter = 0
+        self.is_accepted = False
+        self.start_budget(len(self.input_tokens), trace_level)
+        self.earley_sets = [EarleySet()]
+        self.parse_tree = None
+        self.trace_renderer = EarleyTraceRenderer(self.input_tokens, self.earley_sets)
+        
+        start_symbol = self.compiled_grammar.start_symbol
+        for production_id in self.production_ids_by_symbol.get(start_symbol, []):
+            self.earley_sets[0].add_item((production_id, 0, 0), None)
+        
+        for set_index in range(len(self.input_tokens) + 1):
+            self.process_earley_set(set_index)
+            
+            if set_index < len(self.input_tokens):
+                self.scan_token(set_index)
+                self.add_set_summary_step(set_index)
+                if len(self.earley_sets[set_index + 1].items) == 0:
+                    step_description = "Input rejected - no item can scan '" + self.input_tokens[set_index] + "' at position " + str(set_index)
+                    self.add_result_step("reject", step_description)
+                    return self.parsing_steps
+        
+        final_set = self.earley_sets[len(self.input_tokens)]
+        if (start_symbol, 0) in final_set.first_completions:
+            self.parse_tree = self.build_parse_tree(start_symbol, 0, len(self.input_tokens))
+            self.is_accepted = True
+            self.add_result_step("accept", "Input accepted!")
+        else:
+            self.add_result_step("reject", "Input rejected - no valid parse found")
+        
+        return self.parsing_steps
+    
+    def process_earley_set(self, set_index):
+        earley_set = self.earley_sets[set_index]
+        production_list = self.compiled_grammar.production_list
+        
+        item_index = 0
+        while item_index < len(earley_set.items):
+            item = earley_set.items[item_index]
+            item_index = item_index + 1
+            
+            production_id, dot, origin = item
+            right_side = production_list[production_id].right_side
+            
+            if dot < len(right_side):
+                next_symbol = right_side[dot]
+                if self.compiled_grammar.is_nonterminal(next_symbol):
+                    self.predict_symbol(earley_set, set_index, item, next_symbol)
+            else:
+                self.complete_item(earley_set, set_index, item)
+    
+    def predict_symbol(self, earley_set, set_index, item, next_symbol):
+        earley_set.waiting_items.setdefault(next_symbol, []).append(item)
+        
+        for production_id in self.production_ids_by_symbol.get(next_symbol, []):
+            if earley_set.add_item((production_id, 0, set_index), None):
+                earley_set.predicted_count = earley_set.predicted_count + 1
+        
+        # Aycock-Horspool: a nullable symbol can be stepped over right away, so completions of empty
+        # spans never have to revisit items that started waiting after them
+        if self.analysis.is_nullable(next_symbol):
+            production_id, dot, origin = item
+            earley_set.add_item((production_id, dot + 1, origin), set_index)
+    
+    def complete_item(self, earley_set, set_index, item):
+        production_id, dot, origin = item
+        left_side = self.compiled_grammar.production_list[production_id].left_side
+        
+        completion_key = (left_side, origin)
+        if completion_key in earley_set.first_completions:
+            return
+        earley_set.first_completions[completion_key] = item
+        earley_set.completed_count = earley_set.completed_count + 1
+        
+        if origin == set_index:
+            # Empty spans can add items waiting in this same set while we go through them
+            waiting_items = list(earley_set.waiting_items.get(left_side, []))
+        else:
+            leo_items = self.earley_sets[origin].leo_items
+            if left_side in leo_items:
+                leo_item = leo_items[left_side]
+            else:
+                leo_item = self.get_leo_item(origin, left_side)
+            if leo_item is not None:
+                top_item, back_pointer = leo_item
+                if earley_set.add_item(top_item, back_pointer):
+                    earley_set.leo_sources[top_item] = completion_key
+                return
+            waiting_items = self.earley_sets[origin].waiting_items.get(left_side, [])
+        
+        for waiting_item in waiting_items:
+            waiting_production_id, waiting_dot, waiting_origin = waiting_item
+            earley_set.add_item((waiting_production_id, waiting_dot + 1, waiting_origin), origin)
+    
+    def get_leo_item(self, set_index, symbol):
+        # Leo: when the only item waiting on a symbol ends with it, completing the symbol completes
+        # that item and nothing else, so a whole chain of such items collapses into its topmost one.
+        # This keeps right recursion linear. Sets before the current one never change, so the
+        # chains are cached per set.
+        production_list = self.compiled_grammar.production_list
+        start_symbol = self.compiled_grammar.start_symbol
+        chain = []
+        top_item = None
+        while True:
+            earley_set = self.earley_sets[set_index]
+            if symbol in earley_set.leo_items:
+                top_item = earley_set.leo_items[symbol]
+                break
+            
+            waiting_items = earley_set.waiting_items.get(symbol, [])
+            if len(waiting_items) != 1:
+                earley_set.leo_items[symbol] = None
+                break
+            production_id, dot, origin = waiting_items[0]
+            production = production_list[production_id]
+            # Items over the same span are left to the normal completion, so the first completions
+            # followed by build_parse_tree still cannot form a cycle
+            if dot + 1 != len(production.right_side) or origin == set_index:
+                earley_set.leo_items[symbol] = None
+                break
+            
+            chain.append((earley_set, symbol, ((production_id, dot + 1, origin), set_index)))
+            # The start symbol over the whole input is what acceptance looks for, so it stays a real completion
+            if production.left_side == start_symbol and origin == 0:
+                break
+            set_index = origin
+            symbol = production.left_side
+        
+        for earley_set, symbol, step_item in reversed(chain):
+            if top_item is None:
+                top_item = step_item
+            earley_set.leo_items[symbol] = top_item
+        return top_item
+    
+    def expand_leo_chain(self, set_index, top_item):
+        # Puts back the completions a Leo completion skipped on its way to the topmost item
+        earley_set = self.earley_sets[set_index]
+        symbol, origin = earley_set.leo_sources.pop(top_item)
+        production_list = self.compiled_grammar.production_list
+        while True:
+            production_id, dot, waiting_origin = self.earley_sets[origin].waiting_items[symbol][0]
+            item = (production_id, dot + 1, waiting_origin)
+            if item == top_item:
+                return
+            earley_set.back_pointers.setdefault(item, origin)
+            left_side = production_list[production_id].left_side
+            earley_set.first_completions.setdefault((left_side, waiting_origin), item)
+            symbol = left_side
+            origin = waiting_origin
+    
+    def scan_token(self, set_index):
+        earley_set = self.earley_sets[set_index]
+        next_set = EarleySet()
+        self.earley_sets.append(next_set)
+        # Only terminals are scanned; any other token leaves the next set empty
+        token_id = self.input_token_ids[set_index]
+        if 0 <= token_id < self.compiled_grammar.terminal_count:
+            production_right_ids = self.compiled_grammar.production_right_ids
+            for item in earley_set.items:
+                production_id, dot, origin = item
+                right_ids = production_right_ids[production_id]
+                if dot < len(right_ids) and right_ids[dot] == token_id:
+                    next_set.add_item((production_id, dot + 1, origin), set_index)
+        next_set.scanned_count = len(next_set.items)
+    
+    def add_set_summary_step(self, set_index):
+        self.add_traced_step("scan", position=set_index)
+    
+    def build_parse_tree(self, start_symbol, start_position, end_position):
+        # Following the first completion of every span and the first back pointer of every item
+        # always moves to something added earlier, so the walk cannot cycle on ambiguous grammars
+        production_list = self.compiled_grammar.production_list
+        root_node = TreeNode(start_symbol)
+        pending_nodes = [(root_node, start_position, end_position)]
+        
+        while len(pending_nodes) > 0:
+            tree_node, span_start, span_end = pending_nodes.pop()
+            
+            if span_start == span_end:
+                production = self.analysis.epsilon_productions[tree_node.symbol]
+                if len(production.right_side) == 0:
+                    tree_node.add_child(TreeNode("ε"))
+                for symbol in production.right_side:
+                    child_node = TreeNode(symbol)
+                    tree_node.add_child(child_node)
+                    pending_nodes.append((child_node, span_end, span_end))
+                continue
+            
+            item = self.earley_sets[span_end].first_completions[(tree_node.symbol, span_start)]
+            if item in self.earley_sets[span_end].leo_sources:
+                self.expand_leo_chain(span_end, item)
+            production_id, dot, origin = item
+            right_side = production_list[production_id].right_side
+            
+            children_nodes = []
+            current_position = span_end
+            while dot > 0:
+                symbol_start = self.earley_sets[current_position].back_pointers[(production_id, dot, origin)]
+                symbol = right_side[dot - 1]
+                child_node = TreeNode(symbol)
+                children_nodes.append(child_node)
+                if self.compiled_grammar.is_nonterminal(symbol):
+                    pending_nodes.append((child_node, symbol_start, current_position))
+                current_position = symbol_start
+                dot = dot - 1
+            
+            children_nodes.reverse()
+            tree_node.children = children_nodes
+        
+        return root_node
\ No newline at end of file
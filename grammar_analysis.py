@@ -0,0 +1,324 @@
+import math
+from parsing_core import compile_grammar
+
+
+def get_grammar_analysis(grammar):
+    compiled_grammar = compile_grammar(grammar)
+    if compiled_grammar.analysis is None:
+        compiled_grammar.analysis = GrammarAnalysis(compiled_grammar)
+    return compiled_grammar.analysis
+
+
+class GrammarAnalysis:
+    def __init__(self, compiled_grammar):
+        self.compiled_grammar = compiled_grammar
+        self.nullable_symbols = set()
+        self.epsilon_productions = {}
+        
+        compute_nullable_symbols(compiled_grammar, self.nullable_symbols, self.epsilon_productions)
+        
+        # Filled in on first use by get_left_recursive_cycles
+        self.left_recursive_cycles = None
+        
+        # FIRST sets are bitsets over terminal ids, filled in on first use by get_first_sets
+        self.first_sets = None
+        self.production_first_sets = None
+        # (non-terminal, token id) -> productions that can still match there
+        self.viable_productions = {}
+        
+        # Minimum yield lengths and required terminals, filled in on first use by get_suffix_bounds
+        self.minimum_lengths = None
+        self.required_terminals = None
+        self.production_suffix_bounds = None
+    
+    def is_nullable(self, symbol):
+        return symbol in self.nullable_symbols
+    
+    def get_left_recursive_cycles(self):
+        if self.left_recursive_cycles is None:
+            self.left_recursive_cycles = find_left_recursive_cycles(self.compiled_grammar, self.nullable_symbols)
+        return self.left_recursive_cycles
+    
+    def get_first_sets(self):
+        if self.first_sets is None:
+            self.first_sets, self.production_first_sets = compute_first_sets(self.compiled_grammar, self.nullable_symbols)
+        return self.first_sets
+    
+    def get_viable_productions(self, symbol, token_id):
+        # A production stays viable when the token can start it or when it can match nothing;
+        # token_id is the end marker at the end of input and -1 for tokens outside the grammar
+        viable_key = (symbol, token_id)
+        if viable_key in self.viable_productions:
+            return self.viable_productions[viable_key]
+        
+        self.get_first_sets()
+        token_bit = 0
+        if token_id >= 0:
+            token_bit = 1 << token_id
+        
+        viable_productions = []
+        for production in self.compiled_grammar.get_productions_for_symbol(symbol):
+            production_id = self.compiled_grammar.get_production_id(production)
+            first_set, is_nullable = self.production_first_sets[production_id]
+            if is_nullable or first_set & token_bit:
+                viable_productions.append(production)
+        
+        self.viable_productions[viable_key] = viable_productions
+        return viable_productions
+    
+    def get_suffix_bounds(self, production_id):
+        # Entry i holds (minimum token count, required terminal bitset) for right_side[i:]
+        if self.production_suffix_bounds is None:
+            self.minimum_lengths, self.required_terminals, self.production_suffix_bounds = compute_yield_bounds(self.compiled_grammar)
+        return self.production_suffix_bounds[production_id]
+
+
+def compute_nullable_symbols(compiled_grammar, nullable_symbols, epsilon_productions):
+    # epsilon_productions keeps, for every nullable non-terminal, the production that first proved it
+    # nullable; following those productions always gives a finite epsilon derivation
+    something_changed = True
+    while something_changed:
+        something_changed = False
+        
+        for production in compiled_grammar.production_list:
+            if production.left_side in nullable_symbols:
+                continue
+            
+            all_nullable = True
+            for symbol in production.right_side:
+                if symbol not in nullable_symbols:
+                    all_nullable = False
+                    break
+            
+            if all_nullable:
+                nullable_symbols.add(production.left_side)
+                epsilon_productions[production.left_side] = production
+                something_changed = True
+
+
+def compute_first_sets(compiled_grammar, nullable_symbols):
+    # Fixpoint over the interned right sides; returns symbol -> bitset and, per production id,
+    # (bitset of its right side, whether the right side is nullable)
+    terminal_count = compiled_grammar.terminal_count
+    symbol_first_sets = [0] * len(compiled_grammar.symbol_names)
+    for terminal_id in range(terminal_count):
+        symbol_first_sets[terminal_id] = 1 << terminal_id
+    
+    nullable_ids = set()
+    for symbol in nullable_symbols:
+        nullable_ids.add(compiled_grammar.get_symbol_id(symbol))
+    
+    production_left_ids = []
+    for production in compiled_grammar.production_list:
+        production_left_ids.append(compiled_grammar.get_symbol_id(production.left_side))
+    
+    something_changed = True
+    while something_changed:
+        something_changed = False
+        
+        for production_id, right_ids in enumerate(compiled_grammar.production_right_ids):
+            left_id = production_left_ids[production_id]
+            first_set = symbol_first_sets[left_id]
+            for symbol_id in right_ids:
+                first_set = first_set | symbol_first_sets[symbol_id]
+                if symbol_id not in nullable_ids:
+                    break
+            
+            if first_set != symbol_first_sets[left_id]:
+                symbol_first_sets[left_id] = first_set
+                something_changed = True
+    
+    production_first_sets = []
+    for right_ids in compiled_grammar.production_right_ids:
+        first_set = 0
+        is_nullable = True
+        for symbol_id in right_ids:
+            first_set = first_set | symbol_first_sets[symbol_id]
+            if symbol_id not in nullable_ids:
+                is_nullable = False
+                break
+        production_first_sets.append((first_set, is_nullable))
+    
+    first_sets = {}
+    for symbol_id, symbol in enumerate(compiled_grammar.symbol_names):
+        first_sets.setdefault(symbol, symbol_first_sets[symbol_id])
+    return first_sets, production_first_sets
+
+
+def compute_yield_bounds(compiled_grammar):
+    # Least fixpoint for the minimum number of tokens a symbol derives (math.inf when it derives
+    # nothing), greatest fixpoint for the bitset of terminals that every derivation contains
+    terminal_count = compiled_grammar.terminal_count
+    all_terminals = (1 << terminal_count) - 1
+    symbol_lengths = [math.inf] * len(compiled_grammar.symbol_names)
+    symbol_terminals = [all_terminals] * len(compiled_grammar.symbol_names)
+    for terminal_id in range(terminal_count):
+        symbol_lengths[terminal_id] = 1
+        symbol_terminals[terminal_id] = 1 << terminal_id
+    
+    production_left_ids = []
+    for production in compiled_grammar.production_list:
+        production_left_ids.append(compiled_grammar.get_symbol_id(production.left_side))
+    
+    something_changed = True
+    while something_changed:
+        something_changed = False
+        
+        for production_id, right_ids in enumerate(compiled_grammar.production_right_ids):
+            left_id = production_left_ids[production_id]
+            production_length = 0
+            for symbol_id in right_ids:
+                production_length = production_length + symbol_lengths[symbol_id]
+            
+            if production_length < symbol_lengths[left_id]:
+                symbol_lengths[left_id] = production_length
+                something_changed = True
+    
+    something_changed = True
+    while something_changed:
+        something_changed = False
+        
+        new_terminals = {}
+        for production_id, right_ids in enumerate(compiled_grammar.production_right_ids):
+            left_id = production_left_ids[production_id]
+            production_terminals = 0
+            for symbol_id in right_ids:
+                production_terminals = production_terminals | symbol_terminals[symbol_id]
+            new_terminals[left_id] = new_terminals.get(left_id, all_terminals) & production_terminals
+        
+        for left_id in new_terminals:
+            if new_terminals[left_id] != symbol_terminals[left_id]:
+                symbol_terminals[left_id] = new_terminals[left_id]
+                something_changed = True
+    
+    production_suffix_bounds = []
+    for right_ids in compiled_grammar.production_right_ids:
+        suffix_bounds = [(0, 0)]
+        for symbol_id in reversed(right_ids):
+            suffix_length, suffix_terminals = suffix_bounds[-1]
+            suffix_bounds.append((suffix_length + symbol_lengths[symbol_id], suffix_terminals | symbol_terminals[symbol_id]))
+        suffix_bounds.reverse()
+        production_suffix_bounds.append(suffix_bounds)
+    
+    minimum_lengths = {}
+    required_terminals = {}
+    for symbol_id, symbol in enumerate(compiled_grammar.symbol_names):
+        minimum_lengths.setdefault(symbol, symbol_lengths[symbol_id])
+        required_terminals.setdefault(symbol, symbol_terminals[symbol_id])
+    return minimum_lengths, required_terminals, production_suffix_bounds
+
+
+def build_begins_with_graph(compiled_grammar, nullable_symbols):
+    # A -> B when some production A -> x B y has only nullable symbols in x, so A can start with B
+    # without consuming input
+    begins_with = {}
+    for nonterminal in compiled_grammar.non_terminal_symbols:
+        begins_with[nonterminal] = []
+    
+    added_edges = set()
+    for production in compiled_grammar.production_list:
+        successors = begins_with.setdefault(production.left_side, [])
+        for symbol in production.right_side:
+            if compiled_grammar.is_nonterminal(symbol) and (production.left_side, symbol) not in added_edges:
+                added_edges.add((production.left_side, symbol))
+                successors.append(symbol)
+            if symbol not in nullable_symbols:
+                break
+    
+    return begins_with
+
+
+def find_strongly_connected_components(graph):
+    # Iterative Tarjan, so deep grammars cannot hit the recursion limit; every node and edge is
+    # visited once
+    node_indexes = {}
+    low_links = {}
+    on_stack = set()
+    component_stack = []
+    components = []
+    
+    for root_node in graph:
+        if root_node in node_indexes:
+            continue
+        
+        node_indexes[root_node] = len(node_indexes)
+        low_links[root_node] = node_indexes[root_node]
+        component_stack.append(root_node)
+        on_stack.add(root_node)
+        work_stack = [(root_node, 0)]
+        
+        while len(work_stack) > 0:
+            node, edge_index = work_stack[-1]
+            successors = graph[node]
+            
+            if edge_index < len(successors):
+                work_stack[-1] = (node, edge_index + 1)
+                successor = successors[edge_index]
+                if successor not in node_indexes:
+                    node_indexes[successor] = len(node_indexes)
+                    low_links[successor] = node_indexes[successor]
+                    component_stack.append(successor)
+                    on_stack.add(successor)
+                    work_stack.append((successor, 0))
+                elif successor in on_stack:
+                    low_links[node] = min(low_links[node], node_indexes[successor])
+                continue
+            
+            work_stack.pop()
+            if len(work_stack) > 0:
+                parent_node = work_stack[-1][0]
+                low_links[parent_node] = min(low_links[parent_node], low_links[node])
+            
+            if low_links[node] == node_indexes[node]:
+                component = []
+                while True:
+                    member = component_stack.pop()
+                    on_stack.remove(member)
+                    component.append(member)
+                    if member == node:
+                        break
+                components.append(component)
+    
+    return components
+
+
+def find_left_recursive_cycles(compiled_grammar, nullable_symbols):
+    # One cycle per left-recursive strongly connected component, as a symbol list that starts and
+    # ends with the same non-terminal, in grammar order
+    begins_with = build_begins_with_graph(compiled_grammar, nullable_symbols)
+    symbol_order = {}
+    for symbol in begins_with:
+        symbol_order.setdefault(symbol, len(symbol_order))
+    
+    left_recursive_cycles = []
+    for component in find_strongly_connected_components(begins_with):
+        start_symbol = min(component, key=lambda symbol: symbol_order[symbol])
+        if len(component) == 1 and start_symbol not in begins_with[start_symbol]:
+            continue
+        left_recursive_cycles.append(find_shortest_cycle(begins_with, start_symbol, set(component)))
+    
+    left_recursive_cycles.sort(key=lambda cycle: symbol_order[cycle[0]])
+    return left_recursive_cycles
+
+
+def find_shortest_cycle(graph, start_symbol, component_symbols):
+    # Breadth-first search from start_symbol back to itself inside its component
+    previous_symbols = {}
+    frontier = [start_symbol]
+    while len(frontier) > 0:
+        next_frontier = []
+        for symbol in frontier:
+            for successor in graph[symbol]:
+                if successor == start_symbol:
+                    cycle = [start_symbol]
+                    while symbol != start_symbol:
+                        cycle.append(symbol)
+                        symbol = previous_symbols[symbol]
+                    cycle.append(start_symbol)
+                    cycle.reverse()
+                    return cycle
+                if successor in component_symbols and successor not in previous_symbols:
+                    previous_symbols[successor] = symbol
+                    next_frontier.append(successor)
+        frontier = next_frontier
+    return [start_symbol, start_symbol]
\ No newline at end of file
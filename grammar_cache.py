@@ -0,0 +1,142 @@
+import hashlib
+import os
+import pickle
+import stat
+import tempfile
+from parsing_core import parse_grammar_text, compile_grammar, get_terminal_lexer
+from grammar_analysis import get_grammar_analysis
+from precedence_table import precedence_table_cache, store_precedence_table_entry, get_precedence_table_entry, get_cached_precedence_functions
+
+
+# Bump whenever a pickled class changes shape, so files written by older code are rebuilt
+CACHE_FORMAT_VERSION = 3
+
+
+def get_default_cache_directory():
+    return get_user_cache_directory("grammar_cache")
+
+
+def get_user_cache_directory(directory_name):
+    # A per-user location ($XDG_CACHE_HOME or ~/.cache, LOCALAPPDATA on Windows), never the
+    # shared temporary directory, where anyone could plant files before the first run
+    cache_home = os.environ.get("XDG_CACHE_HOME")
+    if not cache_home and os.name == "nt":
+        cache_home = os.environ.get("LOCALAPPDATA")
+    if not cache_home:
+        cache_home = os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(cache_home, "parsing_visualizer", directory_name)
+
+
+def is_private_status(file_status):
+    # Owned by this user and not writable by group or others; Windows has no uid to compare and
+    # relies on the per-user directory's ACL instead
+    if not hasattr(os, "getuid"):
+        return True
+    return file_status.st_uid == os.getuid() and not (file_status.st_mode & (stat.S_IWGRP | stat.S_IWOTH))
+
+
+def prepare_private_directory(cache_directory):
+    # Cached files are unpickled or executed, so a directory that someone else owns or can write
+    # to is refused (False) rather than used; a new directory is created for this user only
+    try:
+        os.makedirs(cache_directory, mode=0o700, exist_ok=True)
+        directory_status = os.stat(cache_directory)
+    except OSError:
+        return False
+    return stat.S_ISDIR(directory_status.st_mode) and is_private_status(directory_status)
+
+
+def open_private_file(file_path, mode):
+    # None when the file is missing or does not pass is_private_status
+    try:
+        private_file = open(file_path, mode)
+    except OSError:
+        return None
+    if not is_private_status(os.fstat(private_file.fileno())):
+        private_file.close()
+        return None
+    return private_file
+
+
+def get_grammar_text_hash(grammar_text):
+    return hashlib.sha256(grammar_text.encode("utf-8")).hexdigest()
+
+
+def load_grammar_with_cache(grammar_text, cache_directory=None):
+    # Like parse_grammar_text, but the returned Grammar already carries its compiled form, every
+    # analysis and the precedence table; they are pickled under the hash of the text, so editing
+    # the text picks a new file. Pickles run code when loaded, so a cache_directory that another
+    # user owns or can write to is not used at all: the grammar is then built without the cache.
+    if cache_directory is None:
+        cache_directory = get_default_cache_directory()
+    if not prepare_private_directory(cache_directory):
+        grammar = parse_grammar_text(grammar_text)
+        build_all_tables(grammar)
+        return grammar
+    
+    text_hash = get_grammar_text_hash(grammar_text)
+    cache_path = os.path.join(cache_directory, "grammar_v" + str(CACHE_FORMAT_VERSION) + "_" + text_hash + ".pickle")
+    
+    cached_tables = read_cache_file(cache_path, text_hash)
+    if cached_tables is not None:
+        grammar, table_entry = cached_tables
+        if grammar.compiled_grammar.content_hash not in precedence_table_cache:
+            store_precedence_table_entry(grammar.compiled_grammar.content_hash, table_entry)
+        return grammar
+    
+    grammar = parse_grammar_text(grammar_text)
+    table_entry = build_all_tables(grammar)
+    write_cache_file(cache_path, (CACHE_FORMAT_VERSION, text_hash, grammar, table_entry))
+    return grammar
+
+
+def build_all_tables(grammar):
+    compiled_grammar = compile_grammar(grammar)
+    get_terminal_lexer(compiled_grammar)
+    
+    analysis = get_grammar_analysis(compiled_grammar)
+    analysis.get_first_sets()
+    analysis.get_left_recursive_cycles()
+    if compiled_grammar.production_count > 0:
+        analysis.get_suffix_bounds(0)
+    
+    table_entry = get_precedence_table_entry(compiled_grammar)
+    if table_entry.error_message is None:
+        get_cached_precedence_functions(compiled_grammar)
+    return table_entry
+
+
+def read_cache_file(cache_path, text_hash):
+    # A missing, unreadable, foreign or corrupt file is treated as a cache miss; a corrupt pickle
+    # can fail with almost any exception, so all of them count
+    cache_file = open_private_file(cache_path, "rb")
+    if cache_file is None:
+        return None
+    try:
+        with cache_file:
+            cached_data = pickle.load(cache_file)
+    except Exception:
+        return None
+    
+    if not isinstance(cached_data, tuple) or len(cached_data) != 4:
+        return None
+    format_version, cached_hash, grammar, table_entry = cached_data
+    if format_version != CACHE_FORMAT_VERSION or cached_hash != text_hash:
+        return None
+    return grammar, table_entry
+
+
+def write_cache_file(cache_path, cached_data):
+    # Written under a temporary name (mode 0o600) and moved into place, so readers never see
+    # half a file; a cache that cannot be written only costs the next process the rebuild
+    try:
+        file_handle, temporary_path = tempfile.mkstemp(suffix=".pickle", dir=os.path.dirname(cache_path))
+    except OSError:
+        return
+    
+    try:
+        with os.fdopen(file_handle, "wb") as cache_file:
+            pickle.dump(cached_data, cache_file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary_path, cache_path)
+    except OSError:
+        os.remove(temporary_path)
\ No newline at end of file
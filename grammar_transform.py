@@ -0,0 +1,272 @@
+from parsing_core import Grammar, Production, TreeNode, compile_grammar
+from grammar_analysis import get_grammar_analysis, build_begins_with_graph, find_strongly_connected_components
+
+
+# Every rewritten production carries an action list: its right side symbols in order, with the
+# original productions they complete placed where the original parse would reduce them. Replaying
+# the actions of a tree of the rewritten grammar in order rebuilds the original tree bottom-up.
+
+
+class TransformedGrammar:
+    def __init__(self, original_grammar, grammar, production_actions):
+        self.original_grammar = original_grammar
+        self.grammar = grammar
+        self.production_actions = production_actions
+        
+        # (left side, right side) -> actions; BacktrackingParser always keeps the first of two
+        # productions with the same right side, so the first one decides the shape
+        self.actions_by_shape = {}
+        for production, actions in zip(grammar.production_list, production_actions):
+            self.actions_by_shape.setdefault((production.left_side, tuple(production.right_side)), actions)
+    
+    def get_actions_for_node(self, tree_node):
+        child_symbols = []
+        for child in tree_node.children:
+            if child.symbol != "ε":
+                child_symbols.append(child.symbol)
+        
+        shape = (tree_node.symbol, tuple(child_symbols))
+        if shape not in self.actions_by_shape:
+            raise Exception("No production of the transformed grammar matches node '" + tree_node.symbol + "'")
+        return self.actions_by_shape[shape]
+    
+    def rebuild_tree(self, parse_tree):
+        # parse_tree comes from a parser run on self.grammar; the result has the shape the original
+        # grammar would have produced
+        if parse_tree is None:
+            return None
+        
+        built_nodes = []
+        work_stack = [[self.get_actions_for_node(parse_tree), parse_tree.children, 0, 0]]
+        
+        while len(work_stack) > 0:
+            frame = work_stack[-1]
+            actions, children, action_index, child_index = frame
+            
+            if action_index == len(actions):
+                work_stack.pop()
+                continue
+            
+            action = actions[action_index]
+            frame[2] = action_index + 1
+            
+            if isinstance(action, Production):
+                child_count = len(action.right_side)
+                if child_count == 0:
+                    built_nodes.append(TreeNode(action.left_side, [TreeNode("ε")]))
+                else:
+                    reduced_nodes = built_nodes[-child_count:]
+                    del built_nodes[-child_count:]
+                    built_nodes.append(TreeNode(action.left_side, reduced_nodes))
+                continue
+            
+            # A symbol action consumes the next child, skipping the ε leaf of empty productions
+            while children[child_index].symbol == "ε":
+                child_index = child_index + 1
+            child = children[child_index]
+            frame[3] = child_index + 1
+            
+            if child.is_leaf():
+                built_nodes.append(TreeNode(child.symbol))
+            else:
+                work_stack.append([self.get_actions_for_node(child), child.children, 0, 0])
+        
+        if len(built_nodes) != 1:
+            raise Exception("Tree does not match the transformed grammar")
+        return built_nodes[0]
+
+
+def transform_grammar(grammar, eliminate_left_recursion=True, left_factor=True):
+    productions_by_symbol = {}
+    for nonterminal in grammar.non_terminal_symbols:
+        productions_by_symbol[nonterminal] = []
+    for production in grammar.production_list:
+        actions = list(production.right_side)
+        actions.append(production)
+        productions_by_symbol.setdefault(production.left_side, []).append((list(production.right_side), actions))
+    
+    symbol_order = list(productions_by_symbol)
+    used_names = set(grammar.terminal_symbols)
+    used_names.update(symbol_order)
+    
+    if eliminate_left_recursion:
+        remove_left_recursion(grammar, productions_by_symbol, symbol_order, used_names)
+    if left_factor:
+        for nonterminal in list(symbol_order):
+            factor_alternatives(nonterminal, productions_by_symbol, symbol_order, used_names)
+    
+    new_grammar = Grammar()
+    new_grammar.start_symbol = grammar.start_symbol
+    new_grammar.terminal_symbols = list(grammar.terminal_symbols)
+    new_grammar.non_terminal_symbols = list(symbol_order)
+    production_actions = []
+    for nonterminal in symbol_order:
+        for right_side, actions in productions_by_symbol[nonterminal]:
+            new_grammar.production_list.append(Production(nonterminal, right_side))
+            production_actions.append(actions)
+    
+    if eliminate_left_recursion:
+        left_recursive_cycles = get_grammar_analysis(new_grammar).get_left_recursive_cycles()
+        if len(left_recursive_cycles) > 0:
+            cycle_text = "; ".join([" -> ".join(cycle) for cycle in left_recursive_cycles])
+            raise Exception("Left recursion could not be removed, the grammar has cycles or nullable prefixes (" + cycle_text + ")")
+    
+    return TransformedGrammar(grammar, new_grammar, production_actions)
+
+
+def find_first_symbol_action(actions):
+    for action_index in range(len(actions)):
+        if not isinstance(actions[action_index], Production):
+            return action_index
+    return -1
+
+
+def make_helper_symbol(base_symbol, used_names):
+    helper_symbol = base_symbol + "'"
+    while helper_symbol in used_names:
+        helper_symbol = helper_symbol + "'"
+    used_names.add(helper_symbol)
+    return helper_symbol
+
+
+def remove_left_recursion(grammar, productions_by_symbol, symbol_order, used_names):
+    # Paull's algorithm: substitute earlier non-terminals into leading positions, then remove the
+    # direct left recursion that is left. Only symbols of one left-recursive component are
+    # substituted into each other, so the rest of the grammar is left as written
+    compiled_grammar = compile_grammar(grammar)
+    begins_with = build_begins_with_graph(compiled_grammar, get_grammar_analysis(grammar).nullable_symbols)
+    component_by_symbol = {}
+    for component in find_strongly_connected_components(begins_with):
+        if len(component) > 1 or component[0] in begins_with[component[0]]:
+            for symbol in component:
+                component_by_symbol[symbol] = set(component)
+    
+    original_order = list(symbol_order)
+    for symbol_index in range(len(original_order)):
+        nonterminal = original_order[symbol_index]
+        if nonterminal not in component_by_symbol:
+            continue
+        
+        for earlier_symbol in original_order[:symbol_index]:
+            if earlier_symbol not in component_by_symbol[nonterminal]:
+                continue
+            
+            new_alternatives = []
+            for right_side, actions in productions_by_symbol[nonterminal]:
+                if len(right_side) == 0 or right_side[0] != earlier_symbol:
+                    new_alternatives.append((right_side, actions))
+                    continue
+                
+                symbol_position = find_first_symbol_action(actions)
+                for earlier_right_side, earlier_actions in productions_by_symbol[earlier_symbol]:
+                    new_right_side = earlier_right_side + right_side[1:]
+                    new_actions = actions[:symbol_position] + earlier_actions + actions[symbol_position + 1:]
+                    new_alternatives.append((new_right_side, new_actions))
+            productions_by_symbol[nonterminal] = new_alternatives
+        
+        remove_direct_left_recursion(nonterminal, productions_by_symbol, symbol_order, used_names)
+
+
+def remove_direct_left_recursion(nonterminal, productions_by_symbol, symbol_order, used_names):
+    # A -> A a | b  becomes  A -> b A'  and  A' -> a A' | ε
+    recursive_alternatives = []
+    other_alternatives = []
+    for right_side, actions in productions_by_symbol[nonterminal]:
+        if len(right_side) == 0 or right_side[0] != nonterminal:
+            other_alternatives.append((right_side, actions))
+            continue
+        
+        # A -> A only derives what A already derives
+        if len(right_side) == 1:
+            continue
+        
+        # The A on the left is already built when the tail runs, so it is dropped from the actions;
+        # that only keeps the reduce order when nothing was reduced before it
+        symbol_position = find_first_symbol_action(actions)
+        if symbol_position != 0:
+            raise Exception("Left recursion could not be removed, the grammar has cycles or nullable prefixes (" + nonterminal + ")")
+        recursive_alternatives.append((right_side[1:], actions[1:]))
+    
+    if len(recursive_alternatives) == 0:
+        productions_by_symbol[nonterminal] = other_alternatives
+        return
+    
+    helper_symbol = make_helper_symbol(nonterminal, used_names)
+    symbol_order.append(helper_symbol)
+    
+    new_alternatives = []
+    for right_side, actions in other_alternatives:
+        new_alternatives.append((right_side + [helper_symbol], actions + [helper_symbol]))
+    productions_by_symbol[nonterminal] = new_alternatives
+    
+    helper_alternatives = []
+    for right_side, actions in recursive_alternatives:
+        helper_alternatives.append((right_side + [helper_symbol], actions + [helper_symbol]))
+    # The empty tail goes last so the backtracking parser repeats the tail as long as it can
+    helper_alternatives.append(([], []))
+    productions_by_symbol[helper_symbol] = helper_alternatives
+
+
+def get_action_key(action):
+    if isinstance(action, Production):
+        return id(action)
+    return action
+
+
+def find_shared_prefix_length(first_actions, second_actions):
+    # Length of the common action prefix, cut back to end on a symbol
+    shared_length = 0
+    while shared_length < len(first_actions) and shared_length < len(second_actions):
+        if get_action_key(first_actions[shared_length]) != get_action_key(second_actions[shared_length]):
+            break
+        shared_length = shared_length + 1
+    
+    while shared_length > 0 and isinstance(first_actions[shared_length - 1], Production):
+        shared_length = shared_length - 1
+    return shared_length
+
+
+def factor_alternatives(nonterminal, productions_by_symbol, symbol_order, used_names):
+    # A -> x y | x z  becomes  A -> x A'  and  A' -> y | z. Only neighbouring alternatives are
+    # merged, so the backtracking parser still tries them in the original order
+    pending_symbols = [nonterminal]
+    while len(pending_symbols) > 0:
+        current_symbol = pending_symbols.pop()
+        alternatives = productions_by_symbol[current_symbol]
+        new_alternatives = []
+        
+        alternative_index = 0
+        while alternative_index < len(alternatives):
+            right_side, actions = alternatives[alternative_index]
+            group_end = alternative_index + 1
+            prefix_length = len(actions)
+            while group_end < len(alternatives):
+                shared_length = find_shared_prefix_length(actions, alternatives[group_end][1])
+                if shared_length == 0:
+                    break
+                prefix_length = min(prefix_length, shared_length)
+                group_end = group_end + 1
+            
+            if group_end - alternative_index < 2:
+                new_alternatives.append((right_side, actions))
+                alternative_index = group_end
+                continue
+            
+            prefix_symbols = []
+            for action in actions[:prefix_length]:
+                if not isinstance(action, Production):
+                    prefix_symbols.append(action)
+            
+            helper_symbol = make_helper_symbol(current_symbol, used_names)
+            symbol_order.append(helper_symbol)
+            new_alternatives.append((prefix_symbols + [helper_symbol], actions[:prefix_length] + [helper_symbol]))
+            
+            helper_alternatives = []
+            for grouped_right_side, grouped_actions in alternatives[alternative_index:group_end]:
+                helper_alternatives.append((grouped_right_side[len(prefix_symbols):], grouped_actions[prefix_length:]))
+            productions_by_symbol[helper_symbol] = helper_alternatives
+            pending_symbols.append(helper_symbol)
+            
+            alternative_index = group_end
+        
+        productions_by_symbol[current_symbol] = new_alternatives
\ No newline at end of file
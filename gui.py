@@ -3,10 +3,12 @@ from tkinter import scrolledtext, Canvas, font
 from parsing_core import parse_grammar_text
 from backtracking_parser import BacktrackingParser
 from operator_precedence_parser import OperatorPrecedenceParser
+from earley_parser import EarleyParser
 
 
 class ParserGUI:
-    ERROR_TYPES = ["LEFT RECURSION ERROR", "RECURSION DEPTH ERROR", "PRECEDENCE CONFLICT ERROR", "CYCLIC PRECEDENCE ERROR", "PARSING STEPS ERROR"]
+    ERROR_TYPES = ["LEFT RECURSION ERROR", "RECURSION DEPTH ERROR", "STEP LIMIT ERROR", "PRECEDENCE CONFLICT ERROR", "CYCLIC PRECEDENCE ERROR", "PARSING STEPS ERROR", "TIME LIMIT ERROR"]
+    RELATION_SYMBOLS = {"<": "⋖", ">": "⋗", "=": "≐"}
     
     def __init__(self, main_window):
         self.main_window = main_window
@@ -52,6 +54,9 @@ class ParserGUI:
         op_precedence_button = tk.Button(button_frame_1, text="Operator Precedence Parse", command=self.start_op_precedence_parser)
         op_precedence_button.pack(side="left", padx=5)
         
+        earley_button = tk.Button(button_frame_1, text="Earley Parse", command=self.start_earley_parser)
+        earley_button.pack(side="left", padx=5)
+        
         button_frame_2 = tk.Frame(self.main_window)
         button_frame_2.pack(pady=5)
         
@@ -151,16 +156,6 @@ class ParserGUI:
         error_detail = step_description.split(": ", 1)[1] if ": " in step_description else step_description
         self.final_result_label.config(text=error_detail, fg="red")
     
-    def _extract_precedence_relation(self, description):
-        """Extract precedence relation symbol from description"""
-        if " < " in description or " ⋖ " in description:
-            return "⋖"
-        elif " > " in description or " ⋗ " in description:
-            return "⋗"
-        elif " = " in description or " ≐ " in description:
-            return "≐"
-        return ""
-    
     def _check_for_parser_errors(self, parsing_steps):
         """Check if first step contains an error and handle it"""
         if len(parsing_steps) == 0:
@@ -202,6 +197,28 @@ class ParserGUI:
         except Exception as error:
             self.handle_parsing_error(error, "Parsing failed")
     
+    def start_earley_parser(self):
+        if not self.check_if_ready_to_parse():
+            return
+        
+        self.reset_parsing()
+        self.current_parser_type = 'earley'
+        
+        try:
+            earley_parser = EarleyParser(self.current_grammar)
+            input_string = self.input_text_box.get()
+            self.parsing_steps = earley_parser.parse_input(input_string)
+            self.parse_tree_root = earley_parser.parse_tree
+            
+            if len(self.parsing_steps) == 0:
+                self.current_step_label.config(text="No steps generated", fg="orange")
+                return
+            
+            self.enable_step_controls()
+            self.current_step_label.config(text="Earley Parser - Ready (Press Next Step to begin)", fg="black")
+        except Exception as error:
+            self.handle_parsing_error(error, "Parsing failed")
+    
     def start_op_precedence_parser(self):
         if not self.check_if_ready_to_parse():
             return
@@ -258,7 +275,7 @@ class ParserGUI:
             return
         
         if self.current_step_index == 0:
-            if self.current_parser_type == 'backtracking':
+            if self.current_parser_type in ('backtracking', 'earley'):
                 self.tree_scroll_frame.pack(fill="both", expand=True)
                 self.table_container.pack_forget()
                 self.partial_tree_stack = []
@@ -283,7 +300,7 @@ class ParserGUI:
         else:
             self.current_step_label.config(text=step_label_text)
         
-        if self.current_parser_type == 'backtracking':
+        if self.current_parser_type in ('backtracking', 'earley'):
             self.update_parse_tree(current_step)
         elif self.current_parser_type == 'op_precedence':
             self.update_op_table(current_step)
@@ -369,7 +386,8 @@ class ParserGUI:
             "try": "#4A90E2",
             "match": "#7ED321",
             "fail": "#F5A623",
-            "backtrack": "#BD10E0"
+            "backtrack": "#BD10E0",
+            "scan": "#4A90E2"
         }
         color = color_map.get(step.action, "#9B9B9B")
         
@@ -540,42 +558,20 @@ class ParserGUI:
         self.table_canvas.configure(scrollregion=self.table_canvas.bbox("all"))
     
     def update_op_table(self, step):
-        description = step.description
         action = step.action.upper()
         
         stack = ""
         input_str = ""
-        relation = ""
+        relation = self.RELATION_SYMBOLS.get(step.relation, "")
         action_text = action
         
-        if "stack=" in description:
-            stack_start = description.find("stack=")
-            if ", input=" in description:
-                stack_end = description.find(", input=")
-                stack = description[stack_start + 6:stack_end].strip()
-            else:
-                stack = description[stack_start + 6:].strip()
-        
-        if "input=" in description:
-            input_start = description.find("input=")
-            input_str = description[input_start + 6:].strip()
-        
-        relation = self._extract_precedence_relation(description)
+        # Shift/reduce steps carry structured fields; read them instead of parsing the description
+        if step.renderer is not None and step.stack_depth >= 0:
+            stack = step.renderer.render_stack(step)
+            input_str = step.renderer.render_remaining_input(step)
+            action_text = step.renderer.render_action(step)
         
-        if action == "SHIFT":
-            if "Shift '" in description:
-                parts = description.split("'")
-                if len(parts) >= 2:
-                    action_text = "SHIFT " + parts[1]
-            else:
-                action_text = "SHIFT"
-        elif action == "REDUCE":
-            if "Reduce " in description:
-                reduce_part = description.split("Reduce ")[1]
-                if ", stack=" in reduce_part:
-                    reduce_part = reduce_part.split(", stack=")[0]
-                action_text = "REDUCE " + reduce_part
-        elif action == "ACCEPT":
+        if action == "ACCEPT":
             action_text = "ACCEPT"
             relation = "≐"
         
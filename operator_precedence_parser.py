@@ -1,250 +1,505 @@
-from parsing_core import create_parsing_step, add_parsing_step_to_list, tokenize_with_grammar_terminals, is_terminal_symbol, is_nonterminal_symbol, check_for_epsilon_productions, check_for_adjacent_nonterminals
-from precedence_table import build_precedence_table
+from parsing_core import tokenize_with_grammar_terminals, compile_grammar, StepAction, TracedParser, TRACE_FULL, DEFAULT_STEPS_PER_TOKEN
+from precedence_table import get_cached_precedence_table, get_cached_precedence_matrix, get_cached_handle_index, get_cached_precedence_functions
+from token_stream import open_token_stream, TokenStream
+from tree_store import create_tree_builder, TREE_OBJECTS
 
 
-class OperatorPrecedenceParser:
-    def __init__(self, input_grammar):
+class OperatorPrecedenceTraceRenderer:
+    # Steps record only the stack depth; the stack itself is rebuilt by replaying the shifts and
+    # reductions, which is amortised O(1) per step when steps are rendered in order
+    def __init__(self, compiled_grammar, input_tokens, parsing_steps):
+        self.compiled_grammar = compiled_grammar
+        self.input_tokens = input_tokens
+        self.parsing_steps = parsing_steps
+        self.replay_stack = ["$"]
+        self.replay_index = 0
+    
+    def replay_until(self, step):
+        step_index = step.number - 1
+        if self.replay_index > step_index:
+            self.replay_stack = ["$"]
+            self.replay_index = 0
+        
+        while self.replay_index < step_index:
+            self.apply_step(self.parsing_steps[self.replay_index])
+            self.replay_index = self.replay_index + 1
+    
+    def apply_step(self, step):
+        if step.action == StepAction.SHIFT and step.symbol_id >= 0:
+            self.replay_stack.append(self.input_tokens[step.position])
+        elif step.action == StepAction.REDUCE:
+            del self.replay_stack[step.stack_depth - 1:]
+            self.replay_stack.append(step.production.left_side)
+    
+    def get_stack_before(self, step):
+        self.replay_until(step)
+        return self.replay_stack
+    
+    def get_stack_after(self, step):
+        stack_before = self.get_stack_before(step)
+        if step.action == StepAction.SHIFT and step.symbol_id >= 0:
+            return stack_before + [self.input_tokens[step.position]]
+        if step.action == StepAction.REDUCE:
+            return stack_before[:step.stack_depth - 1] + [step.production.left_side]
+        return stack_before
+    
+    def get_top_terminal(self, parsing_stack):
+        for symbol in reversed(parsing_stack):
+            if self.compiled_grammar.is_terminal(symbol) or symbol == "$":
+                return symbol
+        return "$"
+    
+    def get_remaining_input(self, step):
+        if step.action == StepAction.SHIFT and step.symbol_id >= 0:
+            return self.input_tokens[step.position + 1:]
+        return self.input_tokens[step.position:]
+    
+    def render_stack(self, step):
+        if step.stack_depth < 0:
+            return ""
+        return str(self.get_stack_after(step))
+    
+    def render_remaining_input(self, step):
+        if step.position < 0:
+            return ""
+        return str(self.get_remaining_input(step))
+    
+    def render_action(self, step):
+        if step.action == StepAction.SHIFT:
+            if step.symbol_id < 0:
+                return "SHIFT"
+            return "SHIFT " + self.input_tokens[step.position]
+        if step.action == StepAction.REDUCE:
+            return "REDUCE " + self.render_reduction(step)
+        return step.action.upper()
+    
+    def render_reduction(self, step):
+        stack_before = self.get_stack_before(step)
+        handle_symbols = stack_before[step.stack_depth - 1:]
+        reduction_text = " ".join(handle_symbols) + " -> " + step.production.left_side
+        if step.relation is None:
+            reduction_text = reduction_text + " (unit)"
+        return reduction_text
+    
+    def render_step(self, step):
+        stack_text = ", stack=" + self.render_stack(step) + ", input=" + self.render_remaining_input(step)
+        
+        if step.action == StepAction.SHIFT:
+            if step.symbol_id < 0:
+                return "Start: stack=" + self.render_stack(step) + ", input=" + self.render_remaining_input(step)
+            current_input = self.input_tokens[step.position]
+            top_terminal = self.get_top_terminal(self.get_stack_before(step))
+            return "Shift '" + current_input + "' (" + top_terminal + " " + step.relation + " " + current_input + ")" + stack_text
+        
+        if step.action == StepAction.REDUCE:
+            return "Reduce " + self.render_reduction(step) + stack_text
+        
+        return ""
+
+
+class TokenListReader:
+    # One-token lookahead over a token list that already ends with "$"
+    def __init__(self, compiled_grammar, input_tokens):
+        self.compiled_grammar = compiled_grammar
+        self.input_tokens = input_tokens
+        self.token_ids = [compiled_grammar.get_symbol_id(token) for token in input_tokens]
+        self.position = -1
+        self.advance()
+    
+    def advance(self):
+        self.position = self.position + 1
+        if self.position < len(self.input_tokens):
+            self.current_token = self.input_tokens[self.position]
+            self.current_id = self.token_ids[self.position]
+        else:
+            self.current_token = "$"
+            self.current_id = self.compiled_grammar.end_marker_id
+        self.is_at_end = self.position >= len(self.input_tokens) - 1
+
+
+class TokenStreamReader:
+    # One-token lookahead over any iterable of tokens; once it runs out the lookahead is "$"
+    def __init__(self, compiled_grammar, input_tokens, traced_parser):
+        self.compiled_grammar = compiled_grammar
+        self.token_iterator = iter(input_tokens)
+        self.traced_parser = traced_parser
+        self.position = -1
+        self.advance()
+    
+    def advance(self):
+        self.position = self.position + 1
+        next_token = next(self.token_iterator, None)
+        if next_token is None:
+            self.current_token = "$"
+            self.current_id = self.compiled_grammar.end_marker_id
+            self.is_at_end = True
+        else:
+            self.current_token = next_token
+            self.current_id = self.compiled_grammar.get_symbol_id(next_token)
+            self.is_at_end = False
+            self.traced_parser.add_token_to_budget()
+
+
+class TokenArrayReader:
+    # Lookahead over a TokenStream lexed for this grammar: ids come straight from its id column,
+    # and only unknown tokens are ever decoded from the source
+    def __init__(self, compiled_grammar, token_stream, traced_parser):
+        self.compiled_grammar = compiled_grammar
+        self.token_stream = token_stream
+        self.token_ids = token_stream.token_ids
+        self.traced_parser = traced_parser
+        self.position = -1
+        self.advance()
+    
+    def advance(self):
+        self.position = self.position + 1
+        if self.position < len(self.token_ids):
+            self.current_id = self.token_ids[self.position]
+            if self.current_id >= 0:
+                self.current_token = self.compiled_grammar.symbol_names[self.current_id]
+            else:
+                self.current_token = self.token_stream.lexeme(self.position)
+            self.is_at_end = False
+            self.traced_parser.add_token_to_budget()
+        else:
+            self.current_token = "$"
+            self.current_id = self.compiled_grammar.end_marker_id
+            self.is_at_end = True
+
+
+class OperatorPrecedenceStreamRenderer:
+    # Streamed steps outlive the stack they were made on, so they render from their own fields
+    def __init__(self, compiled_grammar):
+        self.compiled_grammar = compiled_grammar
+    
+    def render_step(self, step):
+        if step.action == StepAction.SHIFT:
+            if step.symbol_id < 0:
+                return "Start: stack=['$']"
+            return "Shift '" + self.compiled_grammar.get_symbol_name(step.symbol_id) + "' at position " + str(step.position) + " (" + step.relation + "), stack depth " + str(step.stack_depth)
+        
+        if step.action == StepAction.REDUCE:
+            reduction_text = "Reduce " + str(step.production)
+            if step.relation is None:
+                reduction_text = reduction_text + " (unit)"
+            return reduction_text + " at position " + str(step.position) + ", stack depth " + str(step.stack_depth)
+        
+        return ""
+
+
+class OperatorPrecedenceParser(TracedParser):
+    def __init__(self, input_grammar, use_precedence_functions=False, tree_store=TREE_OBJECTS, trace_level=TRACE_FULL, maximum_steps=100, steps_per_token=DEFAULT_STEPS_PER_TOKEN, time_limit=None):
         self.grammar = input_grammar
+        self.compiled_grammar = compile_grammar(input_grammar)
         self.precedence_relations = {}
+        self.precedence_matrix = None
+        self.handle_index = None
+        # Only derives the f/g precedence functions; relations are still looked up in the matrix
+        # (see build_precedence_table), so the results are the same as without them
+        self.use_precedence_functions = use_precedence_functions
+        self.precedence_functions = None
         self.parsing_steps = []
         self.step_counter = 0
-        self.maximum_steps = 100
+        self.shift_count = 0
+        self.reduce_count = 0
+        self.is_accepted = False
+        self.trace_renderer = None
+        # Parallel to the parse stack: where each terminal sits and its symbol id, so the top
+        # terminal and the handle boundary never need a walk over non-terminals
+        self.terminal_positions = []
+        self.terminal_ids = []
+        # Also parallel to the parse stack: the tree node of every cell ("$" has none) and the
+        # input position its span starts at
+        self.tree_builder = create_tree_builder(self.compiled_grammar, tree_store)
+        self.is_building_tree = False
+        self.node_stack = []
+        self.span_start_stack = []
+        self.parse_tree = None
+        self.init_trace_settings(trace_level, maximum_steps, steps_per_token, time_limit)
+    
+    def parse_input(self, input_string, trace_level=None, maximum_steps=None, steps_per_token=None, time_limit=None, build_tree=True):
+        # build_tree=False skips every tree node allocation, for callers that only want the result
+        input_tokens = self.prepare_input_tokens(input_string)
+        if not self.start_parse(len(input_tokens), trace_level, maximum_steps, steps_per_token, time_limit):
+            return self.parsing_steps
+        
+        token_reader = TokenListReader(self.compiled_grammar, input_tokens)
+        self.trace_renderer = OperatorPrecedenceTraceRenderer(self.compiled_grammar, input_tokens, self.parsing_steps)
+        
+        self.is_building_tree = build_tree
+        for _ in self.run_parse_loop(token_reader):
+            pass
+        return self.parsing_steps
+    
+    def parse_token_stream(self, input_tokens, trace_level=None, maximum_steps=None, steps_per_token=None, time_limit=None, build_tree=False):
+        # Generator over the steps of a parse of any iterable of tokens (without the trailing "$").
+        # Steps are handed out as they are made and not kept, so only the parse stack stays in
+        # memory; a parse tree grows with the input, so it is only built with build_tree=True.
+        # The input size is unknown up front: steps_per_token (DEFAULT_STEPS_PER_TOKEN unless set)
+        # grows the budget per token read, and maximum_steps=math.inf lifts the limit altogether.
+        if not self.start_parse(0, trace_level, maximum_steps, steps_per_token, time_limit):
+            yield from self.take_parsing_steps()
+            return
+        
+        if isinstance(input_tokens, TokenStream) and input_tokens.compiled_grammar is self.compiled_grammar:
+            token_reader = TokenArrayReader(self.compiled_grammar, input_tokens, self)
+        else:
+            token_reader = TokenStreamReader(self.compiled_grammar, input_tokens, self)
+        self.trace_renderer = OperatorPrecedenceStreamRenderer(self.compiled_grammar)
+        
+        self.is_building_tree = build_tree
+        for _ in self.run_parse_loop(token_reader):
+            yield from self.take_parsing_steps()
+        yield from self.take_parsing_steps()
+    
+    def parse_file(self, file_path, trace_level=None, maximum_steps=None, steps_per_token=None, time_limit=None, split_on_whitespace=False):
+        # The file is memory-mapped and lexed into a TokenStream, then parsed as a stream; the
+        # steps are collected here, so use parse_token_stream directly to keep memory bounded
+        with open_token_stream(file_path, self.compiled_grammar, split_on_whitespace) as token_stream:
+            return list(self.parse_token_stream(token_stream, trace_level, maximum_steps, steps_per_token, time_limit, build_tree=True))
+    
+    def take_parsing_steps(self):
+        parsing_steps = self.parsing_steps
+        self.parsing_steps = []
+        return parsing_steps
     
-    def parse_input(self, input_string):
+    def start_parse(self, token_count, trace_level, maximum_steps, steps_per_token, time_limit):
+        self.trace_renderer = None
+        self.parsing_steps = []
+        self.step_counter = 0
+        self.shift_count = 0
+        self.reduce_count = 0
+        self.is_accepted = False
+        self.parse_tree = None
+        self.tree_builder.reset()
+        self.start_budget(token_count, trace_level, maximum_steps, steps_per_token, time_limit)
+        
         try:
             self.build_precedence_table()
         except Exception as e:
             error_message = str(e)
             if "Conflict" in error_message:
-                self.parsing_steps = []
-                self.step_counter = 0
-                self.add_parsing_step("reject", "PRECEDENCE CONFLICT ERROR: Grammar has precedence conflicts - parser cannot determine shift/reduce actions")
-                return self.parsing_steps
+                self.add_result_step("reject", "PRECEDENCE CONFLICT ERROR: Grammar has precedence conflicts - parser cannot determine shift/reduce actions")
+                return False
             else:
                 raise e
-        
-
-        self.parsing_steps = []
-        self.step_counter = 0
-        
-        input_tokens = self.prepare_input_tokens(input_string)
+        return True
+    
+    def run_parse_loop(self, token_reader):
+        # Generator so that streaming callers can take the steps after every iteration that made some
         parsing_stack = ["$"]
-        input_position = 0
+        self.terminal_positions = [0]
+        self.terminal_ids = [self.compiled_grammar.end_marker_id]
+        self.node_stack = [None]
+        self.span_start_stack = [0]
+        
+        self.add_traced_step("shift", position=token_reader.position, stack_depth=len(parsing_stack))
         
-        start_message = "Start: stack=" + str(parsing_stack) + ", input=" + str(input_tokens)
-        self.add_parsing_step("shift", start_message)
+        # A chain of unit reductions longer than the number of non-terminals must be a cycle
+        unit_reduction_count = 0
+        maximum_unit_reductions = len(self.compiled_grammar.non_terminal_symbols)
         
         while True:
-            if self.check_for_acceptance(parsing_stack, input_position, input_tokens):
-                return self.parsing_steps
+            if len(self.parsing_steps) > 0:
+                yield
             
-            if self.try_unit_reduction_if_needed(parsing_stack, input_position, input_tokens):
+            if self.check_for_acceptance(parsing_stack, token_reader):
+                return
+            
+            if self.try_unit_reduction_if_needed(parsing_stack, token_reader):
+                unit_reduction_count = unit_reduction_count + 1
+                if unit_reduction_count > maximum_unit_reductions:
+                    self.add_result_step("reject", "PARSING STEPS ERROR: Unit reductions loop forever - likely caused by cyclic unit productions")
+                    return
                 continue
             
-            parsing_action = self.determine_parsing_action(parsing_stack, input_tokens, input_position)
+            parsing_action = self.determine_parsing_action(parsing_stack, token_reader)
             
             if parsing_action == "error":
-                return self.parsing_steps
+                return
             elif parsing_action == "shift":
-                input_position = self.perform_shift_action(parsing_stack, input_tokens, input_position)
+                self.perform_shift_action(parsing_stack, token_reader)
             elif parsing_action == "reduce":
-                self.perform_reduce_action(parsing_stack, input_tokens, input_position)
+                if not self.perform_reduce_action(parsing_stack, token_reader):
+                    return
             
-            if self.step_counter > self.maximum_steps:
-                self.add_parsing_step("reject", "PARSING STEPS ERROR: Exceeded parsing steps - likely caused by reduce-reduce conflicts or malformed precedence table")
-                return self.parsing_steps
-        
-        return self.parsing_steps
+            if self.step_counter > self.step_limit and self.is_budget_exhausted():
+                if self.is_out_of_time:
+                    self.add_result_step("reject", self.get_time_limit_message())
+                else:
+                    self.add_result_step("reject", "PARSING STEPS ERROR: Exceeded parsing steps - likely caused by reduce-reduce conflicts or malformed precedence table")
+                return
+    
+    def get_statistics(self):
+        return {
+            "steps": self.step_counter,
+            "shifts": self.shift_count,
+            "reductions": self.reduce_count
+        }
     
     def detect_infinite_loop_patterns(self):
-        terminal_symbols = self.grammar.terminal_symbols + ["$"]
-        for symbol_a in terminal_symbols:
-            for symbol_b in terminal_symbols:
-                if symbol_a != symbol_b:
-                    relation_ab = self.get_precedence_relation(symbol_a, symbol_b)
-                    relation_ba = self.get_precedence_relation(symbol_b, symbol_a)
-                    
-                    if relation_ab == ">" and relation_ba == ">":
-                        return True
-        
-        return False
+        if self.precedence_matrix is None:
+            return False
+        return self.precedence_matrix.has_mutual_greater_relation()
     
     def build_precedence_table(self):
-        check_for_epsilon_productions(self.grammar)
-        check_for_adjacent_nonterminals(self.grammar)
-        
-        self.precedence_relations = build_precedence_table(self.grammar)
+        # Built once per grammar content and shared through the precedence table cache
+        self.precedence_relations = get_cached_precedence_table(self.compiled_grammar)
+        self.precedence_matrix = get_cached_precedence_matrix(self.compiled_grammar)
+        self.handle_index = get_cached_handle_index(self.compiled_grammar)
+        if self.use_precedence_functions:
+            # Stays None when the relations have no precedence functions. Lookups read the matrix
+            # either way: the functions agree with it on every related pair and need it for the rest
+            self.precedence_functions = get_cached_precedence_functions(self.compiled_grammar)
     
     def prepare_input_tokens(self, input_string):
         if " " in input_string:
             input_tokens = input_string.split()
         else:
-            input_tokens = tokenize_with_grammar_terminals(input_string, self.grammar)
+            input_tokens = tokenize_with_grammar_terminals(input_string, self.compiled_grammar)
         
         input_tokens.append("$")
         return input_tokens
     
-    def check_for_acceptance(self, parsing_stack, input_position, input_tokens):
+    def check_for_acceptance(self, parsing_stack, token_reader):
         stack_length = len(parsing_stack)
-        if stack_length == 2 and parsing_stack[0] == "$" and parsing_stack[1] == self.grammar.start_symbol:
-            if input_position >= len(input_tokens) - 1:
-                self.add_parsing_step("accept", "Input accepted!")
+        if stack_length == 2 and parsing_stack[0] == "$" and parsing_stack[1] == self.compiled_grammar.start_symbol:
+            if token_reader.is_at_end:
+                self.is_accepted = True
+                if self.is_building_tree:
+                    self.parse_tree = self.tree_builder.get_tree(self.node_stack[1])
+                self.add_result_step("accept", "Input accepted!")
                 return True
         return False
     
-    def try_unit_reduction_if_needed(self, parsing_stack, input_position, input_tokens):
+    def try_unit_reduction_if_needed(self, parsing_stack, token_reader):
         stack_length = len(parsing_stack)
         if stack_length == 2 and parsing_stack[0] == "$":
             stack_top = parsing_stack[1]
-            if is_nonterminal_symbol(stack_top, self.grammar):
-                if input_position >= len(input_tokens) - 1:
-                    return self.try_unit_reduction(parsing_stack, input_tokens, input_position)
+            if self.compiled_grammar.is_nonterminal(stack_top):
+                if token_reader.is_at_end:
+                    return self.try_unit_reduction(parsing_stack, token_reader)
         return False
     
-    def determine_parsing_action(self, parsing_stack, input_tokens, input_position):
-        top_terminal = self.get_top_terminal_from_stack(parsing_stack)
-        if input_position < len(input_tokens):
-            current_input = input_tokens[input_position]
-        else:
-            current_input = "$"
-        
-        precedence_relation = self.get_precedence_relation(top_terminal, current_input)
+    def determine_parsing_action(self, parsing_stack, token_reader):
+        precedence_relation = self.get_precedence_relation_by_id(self.terminal_ids[-1], token_reader.current_id)
         
         if precedence_relation is None:
-            error_message = "No relation between '" + top_terminal + "' and '" + current_input + "'"
-            self.add_parsing_step("reject", error_message)
+            top_terminal = self.get_top_terminal_from_stack(parsing_stack)
+            error_message = "No relation between '" + top_terminal + "' and '" + token_reader.current_token + "'"
+            self.add_result_step("reject", error_message)
             return "error"
         elif precedence_relation == "<" or precedence_relation == "=":
             return "shift"
         elif precedence_relation == ">":
             return "reduce"
     
-    def perform_shift_action(self, parsing_stack, input_tokens, input_position):
-        current_input = input_tokens[input_position]
-        top_terminal = self.get_top_terminal_from_stack(parsing_stack)
-        precedence_relation = self.get_precedence_relation(top_terminal, current_input)
+    def perform_shift_action(self, parsing_stack, token_reader):
+        current_input = token_reader.current_token
+        current_input_id = token_reader.current_id
+        input_position = token_reader.position
+        precedence_relation = self.get_precedence_relation_by_id(self.terminal_ids[-1], current_input_id)
         
+        # Only symbols with a relation are shifted, so the shifted symbol is always a terminal
+        self.terminal_positions.append(len(parsing_stack))
+        self.terminal_ids.append(current_input_id)
         parsing_stack.append(current_input)
+        if self.is_building_tree:
+            self.node_stack.append(self.tree_builder.make_leaf(current_input, input_position))
+            self.span_start_stack.append(input_position)
         
-        remaining_input = input_tokens[input_position + 1:]
-        
-        step_message = "Shift '" + current_input + "' (" + top_terminal + " " + precedence_relation + " " + current_input + "), stack=" + str(parsing_stack) + ", input=" + str(remaining_input)
-        self.add_parsing_step("shift", step_message)
+        self.shift_count = self.shift_count + 1
+        self.add_traced_step("shift", symbol_id=current_input_id, position=input_position, stack_depth=len(parsing_stack), relation=precedence_relation)
         
-        return input_position + 1
+        token_reader.advance()
     
-    def perform_reduce_action(self, parsing_stack, input_tokens, input_position):
+    def perform_reduce_action(self, parsing_stack, token_reader):
         handle_start_position = self.find_handle_start_position(parsing_stack)
         
         if handle_start_position is None:
-            self.add_parsing_step("reject", "Cannot find handle start (no '<' found)")
-            return
+            self.add_result_step("reject", "Cannot find handle start (no '<' found)")
+            return False
         
         handle_symbols = self.extract_handle_from_stack(parsing_stack, handle_start_position)
-        matching_production = self.find_production_for_handle(handle_symbols)
+        matching_production = self.find_production_for_handle(handle_symbols, handle_start_position)
         
         if matching_production is None:
             error_message = "No production matches handle: " + str(handle_symbols)
-            self.add_parsing_step("reject", error_message)
-            return
+            self.add_result_step("reject", error_message)
+            return False
         
-        self.replace_handle_with_nonterminal(parsing_stack, handle_symbols, matching_production, input_tokens, input_position)
+        self.replace_handle_with_nonterminal(parsing_stack, handle_symbols, matching_production, token_reader.position)
+        return True
     
     def extract_handle_from_stack(self, parsing_stack, handle_start_position):
         return parsing_stack[handle_start_position:]
     
-    def replace_handle_with_nonterminal(self, parsing_stack, handle_symbols, matching_production, input_tokens, input_position):
+    def replace_handle_with_nonterminal(self, parsing_stack, handle_symbols, matching_production, input_position):
         for _ in range(len(handle_symbols)):
             parsing_stack.pop()
+        while self.terminal_positions[-1] >= len(parsing_stack):
+            self.terminal_positions.pop()
+            self.terminal_ids.pop()
         
         parsing_stack.append(matching_production.left_side)
+        if self.is_building_tree:
+            handle_start_position = len(parsing_stack) - 1
+            children_nodes = self.node_stack[handle_start_position:]
+            span_start = self.span_start_stack[handle_start_position]
+            del self.node_stack[handle_start_position:]
+            del self.span_start_stack[handle_start_position + 1:]
+            self.node_stack.append(self.tree_builder.make_node(matching_production.left_side, children_nodes, span_start, input_position))
         
-        remaining_input = input_tokens[input_position:]
-        
-        handle_string = " ".join(handle_symbols)
-        step_message = "Reduce " + handle_string + " -> " + matching_production.left_side + ", stack=" + str(parsing_stack) + ", input=" + str(remaining_input)
-        self.add_parsing_step("reduce", step_message)
-    
-    def try_unit_reduction(self, parsing_stack, input_tokens, input_position):
-        current_symbol = parsing_stack[1]
-        
-        remaining_input = input_tokens[input_position:]
-        
-        for production in self.grammar.production_list:
-            if len(production.right_side) == 1 and production.right_side[0] == current_symbol:
-                parsing_stack[1] = production.left_side
-                step_message = "Reduce " + current_symbol + " -> " + production.left_side + " (unit), stack=" + str(parsing_stack) + ", input=" + str(remaining_input)
-                self.add_parsing_step("reduce", step_message)
-                return True
-        
-        return False
+        self.reduce_count = self.reduce_count + 1
+        self.add_traced_step("reduce", position=input_position, stack_depth=len(parsing_stack), relation=">", production=matching_production)
     
-    def _find_terminal_in_stack(self, parsing_stack, start_index=None):
-        if start_index is None:
-            start_index = len(parsing_stack) - 1
+    def try_unit_reduction(self, parsing_stack, token_reader):
+        production = self.handle_index.find_unit_production(parsing_stack[1])
+        if production is None:
+            return False
         
-        stack_index = start_index
-        while stack_index >= 0:
-            current_symbol = parsing_stack[stack_index]
-            if is_terminal_symbol(current_symbol, self.grammar) or current_symbol == "$":
-                return stack_index
-            stack_index = stack_index - 1
-        return None
+        parsing_stack[1] = production.left_side
+        if self.is_building_tree:
+            self.node_stack[1] = self.tree_builder.make_node(production.left_side, [self.node_stack[1]], self.span_start_stack[1], token_reader.position)
+        self.reduce_count = self.reduce_count + 1
+        self.add_traced_step("reduce", position=token_reader.position, stack_depth=len(parsing_stack), production=production)
+        return True
     
     def get_top_terminal_from_stack(self, parsing_stack):
-        terminal_index = self._find_terminal_in_stack(parsing_stack)
-        if terminal_index is not None:
-            return parsing_stack[terminal_index]
-        return "$"
+        return parsing_stack[self.terminal_positions[-1]]
     
     def find_handle_start_position(self, parsing_stack):
-        top_terminal_position = self._find_terminal_in_stack(parsing_stack)
-        
-        if top_terminal_position is None:
+        if len(self.terminal_positions) == 0:
             return None
         
-        previous_terminal_position = top_terminal_position
-        check_index = top_terminal_position - 1
-        while check_index >= 0:
-            current_symbol = parsing_stack[check_index]
-            if is_terminal_symbol(current_symbol, self.grammar) or current_symbol == "$":
-                relation = self.get_precedence_relation(current_symbol, parsing_stack[previous_terminal_position])
-                if relation == "<":
-                    return check_index + 1
-                previous_terminal_position = check_index
-            check_index = check_index - 1
+        # Only terminals take part in the relations, so the walk skips straight between them
+        terminal_index = len(self.terminal_ids) - 1
+        while terminal_index > 0:
+            relation = self.get_precedence_relation_by_id(self.terminal_ids[terminal_index - 1], self.terminal_ids[terminal_index])
+            if relation == "<":
+                return self.terminal_positions[terminal_index - 1] + 1
+            terminal_index = terminal_index - 1
         
         return 1
     
-    def find_production_for_handle(self, handle_symbols):
-        for production in self.grammar.production_list:
-            if self.does_handle_match_production(handle_symbols, production):
-                return production
-        return None
+    def find_production_for_handle(self, handle_symbols, handle_start_position):
+        return self.handle_index.find_production(self.get_handle_skeleton(len(handle_symbols), handle_start_position))
     
-    def does_handle_match_production(self, handle_symbols, production):
-        if len(handle_symbols) != len(production.right_side):
-            return False
-        
-        for i in range(len(handle_symbols)):
-            handle_symbol = handle_symbols[i]
-            production_symbol = production.right_side[i]
-            
-            if is_terminal_symbol(production_symbol, self.grammar):
-                if handle_symbol != production_symbol:
-                    return False
-            else:
-                if not is_nonterminal_symbol(handle_symbol, self.grammar):
-                    return False
-        
-        return True
+    def get_handle_skeleton(self, handle_length, handle_start_position):
+        # Terminals come from the terminal stack; every other stack cell holds a reduced non-terminal
+        handle_skeleton = [None] * handle_length
+        terminal_index = len(self.terminal_positions) - 1
+        while self.terminal_positions[terminal_index] >= handle_start_position:
+            handle_skeleton[self.terminal_positions[terminal_index] - handle_start_position] = self.terminal_ids[terminal_index]
+            terminal_index = terminal_index - 1
+        return tuple(handle_skeleton)
     
     def get_precedence_relation(self, symbol_a, symbol_b):
-        relation_key = (symbol_a, symbol_b)
-        if relation_key in self.precedence_relations:
-            return self.precedence_relations[relation_key]
-        else:
-            return None
+        symbol_a_id = self.compiled_grammar.get_symbol_id(symbol_a)
+        symbol_b_id = self.compiled_grammar.get_symbol_id(symbol_b)
+        return self.get_precedence_relation_by_id(symbol_a_id, symbol_b_id)
     
-    def add_parsing_step(self, action_type, description_text):
-        self.step_counter = add_parsing_step_to_list(self.parsing_steps, self.step_counter, action_type, description_text)
\ No newline at end of file
+    def get_precedence_relation_by_id(self, symbol_a_id, symbol_b_id):
+        if self.precedence_matrix is None:
+            return None
+        return self.precedence_matrix.get_relation_by_id(symbol_a_id, symbol_b_id)
\ No newline at end of file
@@ -1,3 +1,9 @@
+import hashlib
+import re
+import time
+from enum import Enum
+
+
 class Production:
     def __init__(self, left_side, right_side):
         self.left_side = left_side
@@ -30,20 +36,265 @@ class Grammar:
         self.start_symbol = ""
         self.terminal_symbols = []
         self.non_terminal_symbols = []
+        self.compiled_grammar = None
     
     def get_productions_for_symbol(self, symbol):
-        matching_productions = []
-        for production in self.production_list:
-            if production.left_side == symbol:
-                matching_productions.append(production)
-        return matching_productions
+        return compile_grammar(self).get_productions_for_symbol(symbol)
+    
+    def invalidate_compiled_grammar(self):
+        # Needed after editing a production or symbol list in place; see compile_grammar
+        self.compiled_grammar = None
+
+
+END_MARKER = "$"
+
+
+class CompiledGrammar:
+    def __init__(self, grammar, content_hash=None):
+        # Copies, so a parser built on this snapshot is not changed under it by later edits
+        self.grammar = grammar
+        self.production_list = list(grammar.production_list)
+        self.production_count = len(grammar.production_list)
+        self.start_symbol = grammar.start_symbol
+        self.terminal_symbols = list(grammar.terminal_symbols)
+        self.non_terminal_symbols = list(grammar.non_terminal_symbols)
+        
+        # Terminals get ids 0..T-1, the end marker gets T, non-terminals follow
+        self.symbol_names = list(grammar.terminal_symbols) + [END_MARKER] + list(grammar.non_terminal_symbols)
+        self.symbol_ids = {}
+        for symbol_id, symbol in enumerate(self.symbol_names):
+            self.symbol_ids.setdefault(symbol, symbol_id)
+        
+        self.terminal_count = len(grammar.terminal_symbols)
+        self.end_marker_id = self.terminal_count
+        self.terminal_set = set(grammar.terminal_symbols)
+        self.non_terminal_set = set(grammar.non_terminal_symbols)
+        
+        self.productions_by_symbol = {}
+        for nonterminal in grammar.non_terminal_symbols:
+            self.productions_by_symbol[nonterminal] = []
+        for production in grammar.production_list:
+            self.productions_by_symbol.setdefault(production.left_side, []).append(production)
+        
+        self.production_ids = {}
+        self.production_right_ids = []
+        for production_id, production in enumerate(grammar.production_list):
+            self.production_ids[id(production)] = production_id
+            self.production_right_ids.append(tuple(self.symbol_ids[symbol] for symbol in production.right_side))
+        
+        if content_hash is None:
+            content_hash = compute_grammar_hash(grammar)
+        self.content_hash = content_hash
+        
+        # Filled in lazily by grammar_analysis.get_grammar_analysis
+        self.analysis = None
+        self.terminal_lexer = None
+        self.binary_lexer = None  # token_stream.get_binary_lexer
+    
+    def __setstate__(self, state):
+        # production_ids is keyed by object identity, which does not survive pickling
+        self.__dict__.update(state)
+        self.production_ids = {}
+        for production_id, production in enumerate(self.production_list):
+            self.production_ids[id(production)] = production_id
+    
+    def get_productions_for_symbol(self, symbol):
+        return self.productions_by_symbol.get(symbol, [])
+    
+    def is_terminal(self, symbol):
+        return symbol in self.terminal_set
+    
+    def is_nonterminal(self, symbol):
+        return symbol in self.non_terminal_set
+    
+    def get_symbol_id(self, symbol):
+        return self.symbol_ids.get(symbol, -1)
+    
+    def get_symbol_name(self, symbol_id):
+        return self.symbol_names[symbol_id]
+    
+    def get_production_id(self, production):
+        return self.production_ids[id(production)]
+    
+    def has_same_shape(self, grammar):
+        return (self.start_symbol == grammar.start_symbol
+                and self.production_count == len(grammar.production_list)
+                and len(self.terminal_symbols) == len(grammar.terminal_symbols)
+                and len(self.non_terminal_symbols) == len(grammar.non_terminal_symbols))
+
+
+def compute_grammar_hash(grammar):
+    grammar_hash = hashlib.sha256()
+    grammar_hash.update(grammar.start_symbol.encode("utf-8"))
+    # Symbol order fixes the interned ids, which the cached id-indexed tables depend on
+    grammar_hash.update(b"\n" + "\0".join(grammar.terminal_symbols).encode("utf-8"))
+    grammar_hash.update(b"\n" + "\0".join(grammar.non_terminal_symbols).encode("utf-8"))
+    for production in grammar.production_list:
+        grammar_hash.update(b"\n" + production.left_side.encode("utf-8") + b"\0" + "\0".join(production.right_side).encode("utf-8"))
+    return grammar_hash.hexdigest()
+
+
+def compile_grammar(grammar):
+    if isinstance(grammar, CompiledGrammar):
+        return grammar
+    
+    # Only a cheap check runs on every call: a new start symbol or added/removed productions or
+    # symbols compile the grammar again. Edits that keep those counts (a right side changed in
+    # place, a renamed symbol) must call grammar.invalidate_compiled_grammar()
+    compiled_grammar = grammar.compiled_grammar
+    if compiled_grammar is None or not compiled_grammar.has_same_shape(grammar):
+        compiled_grammar = CompiledGrammar(grammar)
+        grammar.compiled_grammar = compiled_grammar
+    return compiled_grammar
+
+
+class StepAction(str, Enum):
+    TRY = "try"
+    MATCH = "match"
+    FAIL = "fail"
+    BACKTRACK = "backtrack"
+    MEMO = "memo"
+    SCAN = "scan"
+    SHIFT = "shift"
+    REDUCE = "reduce"
+    ACCEPT = "accept"
+    REJECT = "reject"
+    
+    def __str__(self):
+        return self.value
+
+
+class ParseResult:
+    __slots__ = ("input_string", "is_accepted", "step_count", "parsing_steps", "parse_tree")
+    
+    def __init__(self, input_string, is_accepted, step_count, parsing_steps, parse_tree=None):
+        self.input_string = input_string
+        self.is_accepted = is_accepted
+        self.step_count = step_count
+        self.parsing_steps = parsing_steps
+        self.parse_tree = parse_tree
+
+
+# Trace levels: every step, only the final result step plus counters, or nothing at all
+TRACE_FULL = "full"
+TRACE_SUMMARY = "summary"
+TRACE_NONE = "none"
+
+# How many steps may pass between two clock reads when a time limit is set
+TIME_CHECK_INTERVAL = 1000
+
+# The parsers' default step budget is maximum_steps plus this much per input token. Linear
+# parses need a few steps per token, so long and deep inputs pass, while exponential
+# backtracking or a looping table still stops early. steps_per_token=0 gives a flat limit.
+DEFAULT_STEPS_PER_TOKEN = 20
 
 
 class ParseStep:
-    def __init__(self, step_number, step_action, step_description):
+    # Steps only keep typed fields; the text is produced by the parser's trace renderer when
+    # description is first read, so recording a step never formats strings
+    __slots__ = ("number", "action", "symbol_id", "position", "end_position", "stack_depth", "relation", "production", "renderer", "rendered_description")
+    
+    def __init__(self, step_number, step_action, step_description=None, symbol_id=-1, position=-1, end_position=-1, stack_depth=-1, relation=None, production=None, renderer=None):
         self.number = step_number
-        self.action = step_action
-        self.description = step_description
+        self.action = StepAction(step_action)
+        self.symbol_id = symbol_id
+        self.position = position
+        self.end_position = end_position
+        self.stack_depth = stack_depth
+        self.relation = relation
+        self.production = production
+        self.renderer = renderer
+        self.rendered_description = step_description
+    
+    @property
+    def description(self):
+        if self.rendered_description is None and self.renderer is not None:
+            self.rendered_description = self.renderer.render_step(self)
+        return self.rendered_description
+
+
+class TracedParser:
+    # Shared trace-level and step/time budget handling; subclasses keep parsing_steps,
+    # step_counter and trace_renderer
+    def init_trace_settings(self, trace_level, maximum_steps, steps_per_token, time_limit):
+        # Defaults for every parse call; maximum_steps may be math.inf for no limit
+        self.trace_level = trace_level
+        self.maximum_steps = maximum_steps
+        self.steps_per_token = steps_per_token
+        self.time_limit = time_limit
+        self.active_trace_level = trace_level
+        self.is_recording_steps = trace_level == TRACE_FULL
+        self.step_budget = maximum_steps
+        self.step_limit = maximum_steps
+        self.active_steps_per_token = steps_per_token
+        self.deadline = None
+        self.is_out_of_time = False
+    
+    def start_budget(self, token_count, trace_level=None, maximum_steps=None, steps_per_token=None, time_limit=None):
+        if trace_level is None:
+            trace_level = self.trace_level
+        if maximum_steps is None:
+            maximum_steps = self.maximum_steps
+        if steps_per_token is None:
+            steps_per_token = self.steps_per_token
+        if time_limit is None:
+            time_limit = self.time_limit
+        
+        self.active_trace_level = trace_level
+        self.is_recording_steps = trace_level == TRACE_FULL
+        self.step_budget = compute_step_budget(maximum_steps, steps_per_token, token_count)
+        self.active_steps_per_token = steps_per_token
+        self.deadline = compute_deadline(time_limit)
+        self.active_time_limit = time_limit
+        self.is_out_of_time = False
+        self.update_step_limit()
+    
+    def update_step_limit(self):
+        # The hot loop only compares step_counter with step_limit; the clock is read once per interval
+        if self.deadline is None:
+            self.step_limit = self.step_budget
+        else:
+            self.step_limit = min(self.step_budget, self.step_counter + TIME_CHECK_INTERVAL)
+    
+    def add_token_to_budget(self):
+        # Streaming parses learn the input size one token at a time
+        if self.active_steps_per_token is not None:
+            self.step_budget = self.step_budget + self.active_steps_per_token
+            self.update_step_limit()
+    
+    def is_budget_exhausted(self):
+        if self.step_counter >= self.step_budget:
+            return True
+        if is_past_deadline(self.deadline):
+            self.is_out_of_time = True
+            return True
+        self.update_step_limit()
+        return False
+    
+    def has_exceeded_budget(self):
+        return self.is_out_of_time or self.step_counter >= self.step_budget
+    
+    def parse_many(self, input_strings, **parse_options):
+        # Streams one ParseResult per input while reusing this parser's grammar tables
+        for input_string in input_strings:
+            parsing_steps = self.parse_input(input_string, **parse_options)
+            yield ParseResult(input_string, self.is_accepted, self.step_counter, parsing_steps, self.parse_tree)
+    
+    def get_time_limit_message(self):
+        return "TIME LIMIT ERROR: Exceeded time limit of " + str(self.active_time_limit) + " seconds"
+    
+    def add_result_step(self, action_type, description_text):
+        if self.active_trace_level != TRACE_NONE:
+            self.add_parsing_step(action_type, description_text)
+    
+    def add_traced_step(self, action_type, **step_fields):
+        if self.is_recording_steps:
+            self.add_parsing_step(action_type, **step_fields)
+        else:
+            self.step_counter = self.step_counter + 1
+    
+    def add_parsing_step(self, action_type, description_text=None, **step_fields):
+        self.step_counter = add_parsing_step_to_list(self.parsing_steps, self.step_counter, action_type, description_text, renderer=self.trace_renderer, **step_fields)
 
 
 def parse_grammar_text(grammar_text):
@@ -52,6 +303,9 @@ def parse_grammar_text(grammar_text):
     
     new_grammar = Grammar()
     text_lines = grammar_text.strip().split("\n")
+    # Sets next to the symbol lists, so each symbol is checked in constant time
+    seen_non_terminals = set()
+    seen_terminals = set()
     
     for line_counter, line in enumerate(text_lines):
         line_number = line_counter + 1
@@ -87,15 +341,18 @@ def parse_grammar_text(grammar_text):
             new_production = Production(left_part, symbol_list)
             new_grammar.production_list.append(new_production)
             
-            if left_part not in new_grammar.non_terminal_symbols:
+            if left_part not in seen_non_terminals:
+                seen_non_terminals.add(left_part)
                 new_grammar.non_terminal_symbols.append(left_part)
             
             for symbol in symbol_list:
                 if symbol[0].isupper():
-                    if symbol not in new_grammar.non_terminal_symbols:
+                    if symbol not in seen_non_terminals:
+                        seen_non_terminals.add(symbol)
                         new_grammar.non_terminal_symbols.append(symbol)
                 else:
-                    if symbol not in new_grammar.terminal_symbols:
+                    if symbol not in seen_terminals:
+                        seen_terminals.add(symbol)
                         new_grammar.terminal_symbols.append(symbol)
     
     if len(new_grammar.production_list) == 0:
@@ -105,17 +362,34 @@ def parse_grammar_text(grammar_text):
     return new_grammar
 
 
-def create_parsing_step(step_number, action_type, description_text):
-    return ParseStep(step_number, action_type, description_text)
+def create_parsing_step(step_number, action_type, description_text=None, **step_fields):
+    return ParseStep(step_number, action_type, description_text, **step_fields)
 
 
-def add_parsing_step_to_list(parsing_steps, step_counter, action_type, description_text):
+def add_parsing_step_to_list(parsing_steps, step_counter, action_type, description_text=None, **step_fields):
     step_counter = step_counter + 1
-    new_step = create_parsing_step(step_counter, action_type, description_text)
+    new_step = create_parsing_step(step_counter, action_type, description_text, **step_fields)
     parsing_steps.append(new_step)
     return step_counter
 
 
+def compute_step_budget(maximum_steps, steps_per_token, token_count):
+    # maximum_steps may be math.inf; steps_per_token scales the budget with the input size
+    if steps_per_token is None:
+        return maximum_steps
+    return maximum_steps + steps_per_token * token_count
+
+
+def compute_deadline(time_limit):
+    if time_limit is None:
+        return None
+    return time.perf_counter() + time_limit
+
+
+def is_past_deadline(deadline):
+    return deadline is not None and time.perf_counter() > deadline
+
+
 def tokenize_input_string(input_string):
     if " " in input_string:
         return input_string.split()
@@ -124,11 +398,11 @@ def tokenize_input_string(input_string):
 
 
 def is_terminal_symbol(symbol, grammar):
-    return symbol in grammar.terminal_symbols
+    return symbol in compile_grammar(grammar).terminal_set
 
 
 def is_nonterminal_symbol(symbol, grammar):
-    return symbol in grammar.non_terminal_symbols
+    return symbol in compile_grammar(grammar).non_terminal_set
 
 
 def check_for_epsilon_productions(grammar):
@@ -138,40 +412,61 @@ def check_for_epsilon_productions(grammar):
 
 
 def check_for_adjacent_nonterminals(grammar):
+    compiled_grammar = compile_grammar(grammar)
     for production in grammar.production_list:
         for i in range(len(production.right_side) - 1):
             current_symbol = production.right_side[i]
             next_symbol = production.right_side[i + 1]
             
-            if is_nonterminal_symbol(current_symbol, grammar) and is_nonterminal_symbol(next_symbol, grammar):
+            if compiled_grammar.is_nonterminal(current_symbol) and compiled_grammar.is_nonterminal(next_symbol):
                 raise Exception("Adjacent non-terminals not allowed: " + str(production))
 
 
-def tokenize_with_grammar_terminals(input_text, grammar):
-    token_list = []
-    text_position = 0
+def build_terminal_trie(terminal_symbols):
+    trie_root = {}
+    for terminal in terminal_symbols:
+        trie_node = trie_root
+        for character in terminal:
+            trie_node = trie_node.setdefault(character, {})
+        trie_node[""] = True
+    return trie_root
+
+
+def trie_to_pattern(trie_node):
+    branches = []
+    for character in sorted(trie_node):
+        if character != "":
+            branches.append(re.escape(character) + trie_to_pattern(trie_node[character]))
     
-    sorted_terminals = sorted(grammar.terminal_symbols, key=len, reverse=True)
+    if len(branches) == 0:
+        return ""
     
-    while text_position < len(input_text):
-        if input_text[text_position].isspace():
-            text_position = text_position + 1
-            continue
-        
-        token_matched = False
-        for terminal in sorted_terminals:
-            terminal_length = len(terminal)
-            
-            if text_position + terminal_length <= len(input_text):
-                text_slice = input_text[text_position:text_position + terminal_length]
-                if text_slice == terminal:
-                    token_list.append(terminal)
-                    text_position = text_position + terminal_length
-                    token_matched = True
-                    break
-        
-        if not token_matched:
-            token_list.append(input_text[text_position])
-            text_position = text_position + 1
+    if len(branches) == 1:
+        pattern = branches[0]
+    else:
+        pattern = "(?:" + "|".join(branches) + ")"
     
-    return token_list
\ No newline at end of file
+    # A terminal ending here makes the longer continuations optional; greedy matching still
+    # prefers them, which gives the longest match
+    if "" in trie_node:
+        if len(branches) == 1:
+            pattern = "(?:" + pattern + ")"
+        pattern = pattern + "?"
+    return pattern
+
+
+def get_terminal_lexer(grammar):
+    compiled_grammar = compile_grammar(grammar)
+    if compiled_grammar.terminal_lexer is None:
+        # Terminals never contain whitespace, so findall skips whitespace on its own and any
+        # character that starts no terminal becomes a one-character token
+        terminal_pattern = trie_to_pattern(build_terminal_trie(compiled_grammar.terminal_symbols))
+        if terminal_pattern == "":
+            compiled_grammar.terminal_lexer = re.compile(r"\S")
+        else:
+            compiled_grammar.terminal_lexer = re.compile(terminal_pattern + r"|\S")
+    return compiled_grammar.terminal_lexer
+
+
+def tokenize_with_grammar_terminals(input_text, grammar):
+    return get_terminal_lexer(grammar).findall(input_text)
\ No newline at end of file
@@ -0,0 +1,190 @@
+import sys
+from parsing_core import parse_grammar_text, compile_grammar, get_terminal_lexer, END_MARKER
+from precedence_table import get_cached_precedence_matrix, get_cached_handle_index
+
+
+# The generated module only needs re; tables are written out as literals, so importing it does
+# no grammar parsing and no LEADING/TRAILING work
+PARSER_TEMPLATE = '''# Operator precedence parser generated by precedence_compiler, do not edit
+# Grammar {content_hash}
+import re
+
+
+START_SYMBOL = {start_symbol}
+NON_TERMINALS = {non_terminals}
+
+# Terminals index the relation table by id with the end marker after them; every other token
+# gets UNKNOWN_ID, whose row and column hold no relations
+TOKEN_IDS = {token_ids}
+END_MARKER_ID = {end_marker_id}
+UNKNOWN_ID = {unknown_id}
+TABLE_WIDTH = {table_width}
+
+# Row-major relation codes: 0 no relation, 1 '<', 2 '=', 3 '>'
+RELATION_CODES = {relation_codes}
+
+# Handle skeleton (terminal ids, None for non-terminal slots) -> left side of the production
+HANDLE_PRODUCTIONS = {handle_productions}
+UNIT_PRODUCTIONS = {unit_productions}
+MAXIMUM_UNIT_REDUCTIONS = {maximum_unit_reductions}
+
+TERMINAL_LEXER = re.compile({lexer_pattern})
+
+
+class TreeNode:
+    def __init__(self, symbol, children=None):
+        self.symbol = symbol
+        self.children = children if children is not None else []
+    
+    def is_leaf(self):
+        return len(self.children) == 0
+
+
+def tokenize(input_string):
+    if " " in input_string:
+        return input_string.split()
+    return TERMINAL_LEXER.findall(input_string)
+
+
+def parse_input(input_string, build_tree=True):
+    return parse_tokens(tokenize(input_string), build_tree)
+
+
+def parse_tokens(input_tokens, build_tree=True):
+    # Returns (is_accepted, parse_tree, message); input_tokens has no trailing "$"
+    token_ids = [TOKEN_IDS.get(token, UNKNOWN_ID) for token in input_tokens]
+    token_count = len(token_ids)
+    token_ids.append(END_MARKER_ID)
+    
+    parsing_stack = ["$"]
+    terminal_positions = [0]
+    terminal_ids = [END_MARKER_ID]
+    node_stack = [None]
+    unit_reduction_count = 0
+    position = 0
+    
+    while True:
+        if position >= token_count and len(parsing_stack) == 2:
+            if parsing_stack[1] == START_SYMBOL:
+                return (True, node_stack[1], "Input accepted!")
+            
+            unit_left_side = None
+            if parsing_stack[1] in NON_TERMINALS:
+                unit_left_side = UNIT_PRODUCTIONS.get(parsing_stack[1])
+            if unit_left_side is not None:
+                unit_reduction_count = unit_reduction_count + 1
+                if unit_reduction_count > MAXIMUM_UNIT_REDUCTIONS:
+                    return (False, None, "PARSING STEPS ERROR: Unit reductions loop forever - likely caused by cyclic unit productions")
+                parsing_stack[1] = unit_left_side
+                if build_tree:
+                    node_stack[1] = TreeNode(unit_left_side, [node_stack[1]])
+                continue
+        
+        current_id = token_ids[position]
+        relation_code = RELATION_CODES[terminal_ids[-1] * TABLE_WIDTH + current_id]
+        
+        if relation_code == 0:
+            current_token = input_tokens[position] if position < token_count else "$"
+            return (False, None, "No relation between '" + parsing_stack[terminal_positions[-1]] + "' and '" + current_token + "'")
+        
+        if relation_code != 3:
+            current_token = input_tokens[position] if position < token_count else "$"
+            terminal_positions.append(len(parsing_stack))
+            terminal_ids.append(current_id)
+            parsing_stack.append(current_token)
+            if build_tree:
+                node_stack.append(TreeNode(current_token))
+            position = position + 1
+            continue
+        
+        # The handle starts after the nearest terminal below that is '<' its right neighbour
+        handle_start = 1
+        terminal_index = len(terminal_ids) - 1
+        while terminal_index > 0:
+            if RELATION_CODES[terminal_ids[terminal_index - 1] * TABLE_WIDTH + terminal_ids[terminal_index]] == 1:
+                handle_start = terminal_positions[terminal_index - 1] + 1
+                break
+            terminal_index = terminal_index - 1
+        
+        handle_skeleton = [None] * (len(parsing_stack) - handle_start)
+        terminal_index = len(terminal_positions) - 1
+        while terminal_positions[terminal_index] >= handle_start:
+            handle_skeleton[terminal_positions[terminal_index] - handle_start] = terminal_ids[terminal_index]
+            terminal_index = terminal_index - 1
+        
+        left_side = HANDLE_PRODUCTIONS.get(tuple(handle_skeleton))
+        if left_side is None:
+            return (False, None, "No production matches handle: " + str(parsing_stack[handle_start:]))
+        
+        del parsing_stack[handle_start:]
+        del terminal_positions[terminal_index + 1:]
+        del terminal_ids[terminal_index + 1:]
+        parsing_stack.append(left_side)
+        if build_tree:
+            children_nodes = node_stack[handle_start:]
+            del node_stack[handle_start:]
+            node_stack.append(TreeNode(left_side, children_nodes))
+'''
+
+
+def generate_precedence_parser_source(grammar):
+    # Raises the table builder's error (conflicts, epsilon productions, adjacent non-terminals)
+    # instead of writing a module that could only reject
+    compiled_grammar = compile_grammar(grammar)
+    precedence_matrix = get_cached_precedence_matrix(compiled_grammar)
+    handle_index = get_cached_handle_index(compiled_grammar)
+    
+    # The matrix gets one more row and column for UNKNOWN_ID
+    symbol_count = precedence_matrix.symbol_count
+    table_width = symbol_count + 1
+    relation_codes = bytearray(table_width * table_width)
+    for symbol_a_id in range(symbol_count):
+        for symbol_b_id in range(symbol_count):
+            relation_codes[symbol_a_id * table_width + symbol_b_id] = precedence_matrix.get_relation_code(symbol_a_id, symbol_b_id)
+    
+    token_ids = {}
+    for terminal in compiled_grammar.terminal_symbols:
+        token_ids.setdefault(terminal, compiled_grammar.get_symbol_id(terminal))
+    token_ids.setdefault(END_MARKER, compiled_grammar.end_marker_id)
+    
+    handle_productions = {}
+    for handle_skeleton, production in handle_index.handle_productions.items():
+        handle_productions[handle_skeleton] = production.left_side
+    unit_productions = {}
+    for symbol, production in handle_index.unit_productions.items():
+        unit_productions[symbol] = production.left_side
+    
+    non_terminals = []
+    for nonterminal in compiled_grammar.non_terminal_symbols:
+        if nonterminal not in non_terminals:
+            non_terminals.append(nonterminal)
+    
+    return PARSER_TEMPLATE.format(
+        content_hash=compiled_grammar.content_hash,
+        start_symbol=repr(compiled_grammar.start_symbol),
+        non_terminals="frozenset(" + repr(non_terminals) + ")",
+        token_ids=repr(token_ids),
+        end_marker_id=compiled_grammar.end_marker_id,
+        unknown_id=symbol_count,
+        table_width=table_width,
+        relation_codes=repr(bytes(relation_codes)),
+        handle_productions=repr(handle_productions),
+        unit_productions=repr(unit_productions),
+        maximum_unit_reductions=len(compiled_grammar.non_terminal_symbols),
+        lexer_pattern=repr(get_terminal_lexer(compiled_grammar).pattern)
+    )
+
+
+def write_precedence_parser(grammar, output_path):
+    source_text = generate_precedence_parser_source(grammar)
+    with open(output_path, "w", encoding="utf-8") as output_file:
+        output_file.write(source_text)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("Usage: python precedence_compiler.py GRAMMAR_FILE OUTPUT_MODULE")
+        sys.exit(2)
+    with open(sys.argv[1], encoding="utf-8") as grammar_file:
+        grammar_text = grammar_file.read()
+    write_precedence_parser(parse_grammar_text(grammar_text), sys.argv[2])
\ No newline at end of file
@@ -1,4 +1,262 @@
-from parsing_core import is_terminal_symbol, is_nonterminal_symbol
+from array import array
+from collections import OrderedDict
+from parsing_core import is_terminal_symbol, is_nonterminal_symbol, compile_grammar, check_for_epsilon_productions, check_for_adjacent_nonterminals
+
+
+# Grammar content hash -> PrecedenceTableEntry, shared by every parser instance in the process.
+# The matrix is indexed by interned symbol id, so the key must change with the symbol order too;
+# compute_grammar_hash covers the terminal and non-terminal lists for that reason.
+# An entry keeps the CompiledGrammar it was built from, and with it the first Grammar seen with
+# that hash: HandleIndex hands out that grammar's Production objects to every later grammar with
+# the same content. Least recently used entries are dropped beyond PRECEDENCE_TABLE_CACHE_LIMIT.
+precedence_table_cache = OrderedDict()
+PRECEDENCE_TABLE_CACHE_LIMIT = 32
+
+# Matrix cell codes; RELATION_NAMES[code] is the relation as stored in precedence_relations
+NO_RELATION = 0
+LESS_RELATION = 1
+EQUAL_RELATION = 2
+GREATER_RELATION = 3
+RELATION_NAMES = (None, "<", "=", ">")
+RELATION_CODES = {"<": LESS_RELATION, "=": EQUAL_RELATION, ">": GREATER_RELATION}
+
+
+class PrecedenceTableEntry:
+    def __init__(self, precedence_relations, error_message):
+        self.precedence_relations = precedence_relations
+        self.error_message = error_message
+        self.precedence_matrix = None
+        self.handle_index = None
+        self.precedence_functions = None
+        self.has_built_functions = False
+
+
+class PrecedenceMatrix:
+    # Dense (T+1) x (T+1) table of relation codes, indexed by terminal symbol id with the end
+    # marker last; rows and columns of '>' are also kept as bitsets for whole-table checks
+    def __init__(self, compiled_grammar, precedence_relations):
+        self.compiled_grammar = compiled_grammar
+        self.symbol_count = compiled_grammar.end_marker_id + 1
+        self.relation_codes = array("b", bytes(self.symbol_count * self.symbol_count))
+        self.greater_rows = [0] * self.symbol_count
+        self.greater_columns = [0] * self.symbol_count
+        
+        for relation_key in precedence_relations:
+            symbol_a_id = compiled_grammar.get_symbol_id(relation_key[0])
+            symbol_b_id = compiled_grammar.get_symbol_id(relation_key[1])
+            relation_code = RELATION_CODES[precedence_relations[relation_key]]
+            self.relation_codes[symbol_a_id * self.symbol_count + symbol_b_id] = relation_code
+            if relation_code == GREATER_RELATION:
+                self.greater_rows[symbol_a_id] |= 1 << symbol_b_id
+                self.greater_columns[symbol_b_id] |= 1 << symbol_a_id
+    
+    def get_relation(self, symbol_a, symbol_b):
+        symbol_a_id = self.compiled_grammar.get_symbol_id(symbol_a)
+        symbol_b_id = self.compiled_grammar.get_symbol_id(symbol_b)
+        return RELATION_NAMES[self.get_relation_code(symbol_a_id, symbol_b_id)]
+    
+    def get_relation_by_id(self, symbol_a_id, symbol_b_id):
+        return RELATION_NAMES[self.get_relation_code(symbol_a_id, symbol_b_id)]
+    
+    def get_relation_code(self, symbol_a_id, symbol_b_id):
+        # Ids outside the terminals (non-terminals typed as input, unknown tokens) relate to nothing
+        if symbol_a_id < 0 or symbol_a_id >= self.symbol_count or symbol_b_id < 0 or symbol_b_id >= self.symbol_count:
+            return NO_RELATION
+        return self.relation_codes[symbol_a_id * self.symbol_count + symbol_b_id]
+    
+    def has_mutual_greater_relation(self):
+        # a > b together with b > a for some a != b: the row of '>' relations of a meets its column
+        for symbol_id in range(self.symbol_count):
+            if self.greater_rows[symbol_id] & self.greater_columns[symbol_id] & ~(1 << symbol_id):
+                return True
+        return False
+
+
+class HandleIndex:
+    # A handle matches a production when its terminals agree and every other slot holds a
+    # non-terminal, so productions are keyed by their right side with non-terminals as None
+    def __init__(self, compiled_grammar):
+        self.handle_productions = {}
+        self.unit_productions = {}
+        
+        for production in compiled_grammar.production_list:
+            handle_skeleton = []
+            for symbol in production.right_side:
+                if compiled_grammar.is_terminal(symbol):
+                    handle_skeleton.append(compiled_grammar.get_symbol_id(symbol))
+                else:
+                    handle_skeleton.append(None)
+            # The first production in grammar order wins, as with the old linear scan
+            self.handle_productions.setdefault(tuple(handle_skeleton), production)
+            
+            if len(production.right_side) == 1:
+                self.unit_productions.setdefault(production.right_side[0], production)
+    
+    def find_production(self, handle_skeleton):
+        return self.handle_productions.get(handle_skeleton)
+    
+    def find_unit_production(self, symbol):
+        return self.unit_productions.get(symbol)
+
+
+class PrecedenceFunctions:
+    # Floyd/Bell precedence functions: a < b, a = b and a > b become f(a) < g(b), f(a) == g(b) and
+    # f(a) > g(b). Both lists are indexed by terminal symbol id, with the end marker last.
+    # The functions order every pair, while a pair the table leaves empty must stay an error, or
+    # input outside the language could be accepted. So the full matrix is still needed to tell
+    # related pairs apart: this saves no memory over the matrix, and a lookup is no faster.
+    def __init__(self, compiled_grammar, f_values, g_values, precedence_matrix):
+        self.compiled_grammar = compiled_grammar
+        self.f_values = f_values
+        self.g_values = g_values
+        self.precedence_matrix = precedence_matrix
+    
+    def get_relation(self, symbol_a, symbol_b):
+        symbol_a_id = self.compiled_grammar.get_symbol_id(symbol_a)
+        symbol_b_id = self.compiled_grammar.get_symbol_id(symbol_b)
+        return self.get_relation_by_id(symbol_a_id, symbol_b_id)
+    
+    def get_relation_by_id(self, symbol_a_id, symbol_b_id):
+        if self.precedence_matrix.get_relation_code(symbol_a_id, symbol_b_id) == NO_RELATION:
+            return None
+        
+        f_value = self.f_values[symbol_a_id]
+        g_value = self.g_values[symbol_b_id]
+        if f_value < g_value:
+            return "<"
+        if f_value > g_value:
+            return ">"
+        return "="
+
+
+def get_precedence_table_entry(grammar):
+    compiled_grammar = compile_grammar(grammar)
+    table_entry = precedence_table_cache.get(compiled_grammar.content_hash)
+    
+    if table_entry is not None:
+        precedence_table_cache.move_to_end(compiled_grammar.content_hash)
+        return table_entry
+    
+    try:
+        check_for_epsilon_productions(compiled_grammar)
+        check_for_adjacent_nonterminals(compiled_grammar)
+        table_entry = PrecedenceTableEntry(build_precedence_table(compiled_grammar), None)
+        table_entry.precedence_matrix = PrecedenceMatrix(compiled_grammar, table_entry.precedence_relations)
+        table_entry.handle_index = HandleIndex(compiled_grammar)
+    except Exception as error:
+        table_entry = PrecedenceTableEntry(None, str(error))
+    store_precedence_table_entry(compiled_grammar.content_hash, table_entry)
+    return table_entry
+
+
+def store_precedence_table_entry(content_hash, table_entry):
+    precedence_table_cache[content_hash] = table_entry
+    precedence_table_cache.move_to_end(content_hash)
+    while len(precedence_table_cache) > PRECEDENCE_TABLE_CACHE_LIMIT:
+        precedence_table_cache.popitem(last=False)
+
+
+def get_cached_precedence_table(grammar):
+    table_entry = get_precedence_table_entry(grammar)
+    if table_entry.error_message is not None:
+        raise Exception(table_entry.error_message)
+    return table_entry.precedence_relations
+
+
+def get_cached_precedence_matrix(grammar):
+    table_entry = get_precedence_table_entry(grammar)
+    if table_entry.error_message is not None:
+        raise Exception(table_entry.error_message)
+    return table_entry.precedence_matrix
+
+
+def get_cached_handle_index(grammar):
+    table_entry = get_precedence_table_entry(grammar)
+    if table_entry.error_message is not None:
+        raise Exception(table_entry.error_message)
+    return table_entry.handle_index
+
+
+def get_cached_precedence_functions(grammar):
+    # None when the relations admit no precedence functions; callers then keep the full table
+    table_entry = get_precedence_table_entry(grammar)
+    if table_entry.error_message is not None:
+        raise Exception(table_entry.error_message)
+    
+    if not table_entry.has_built_functions:
+        table_entry.precedence_functions = build_precedence_functions(grammar, table_entry.precedence_relations, table_entry.precedence_matrix)
+        table_entry.has_built_functions = True
+    return table_entry.precedence_functions
+
+
+def build_precedence_functions(grammar, precedence_relations, precedence_matrix):
+    compiled_grammar = compile_grammar(grammar)
+    symbol_count = compiled_grammar.end_marker_id + 1
+    
+    # Graph nodes: f(a) is node a, g(b) is node symbol_count + b. Nodes forced equal by '=' are
+    # merged first, then the value of every group is the longest path below it.
+    group_parents = list(range(2 * symbol_count))
+    
+    for relation_key in precedence_relations:
+        if precedence_relations[relation_key] == "=":
+            group_a = find_group(group_parents, compiled_grammar.get_symbol_id(relation_key[0]))
+            group_b = find_group(group_parents, symbol_count + compiled_grammar.get_symbol_id(relation_key[1]))
+            group_parents[group_a] = group_b
+    
+    # greater_group -> [smaller groups] for every f(a) > g(b) and g(b) > f(a)
+    smaller_groups = {}
+    larger_groups = {}
+    for relation_key in precedence_relations:
+        relation_type = precedence_relations[relation_key]
+        if relation_type == "=":
+            continue
+        f_group = find_group(group_parents, compiled_grammar.get_symbol_id(relation_key[0]))
+        g_group = find_group(group_parents, symbol_count + compiled_grammar.get_symbol_id(relation_key[1]))
+        if relation_type == ">":
+            greater_group, smaller_group = f_group, g_group
+        else:
+            greater_group, smaller_group = g_group, f_group
+        if greater_group == smaller_group:
+            return None
+        smaller_groups.setdefault(greater_group, []).append(smaller_group)
+        larger_groups.setdefault(smaller_group, []).append(greater_group)
+    
+    # Longest paths by peeling off groups with nothing left below them; groups that are never
+    # peeled sit on a cycle, and then no precedence functions exist
+    all_groups = set(find_group(group_parents, node) for node in range(2 * symbol_count))
+    remaining_below = {}
+    group_values = {}
+    ready_groups = []
+    for group in all_groups:
+        remaining_below[group] = len(smaller_groups.get(group, []))
+        group_values[group] = 0
+        if remaining_below[group] == 0:
+            ready_groups.append(group)
+    
+    finished_count = 0
+    while len(ready_groups) > 0:
+        group = ready_groups.pop()
+        finished_count = finished_count + 1
+        for greater_group in larger_groups.get(group, []):
+            if group_values[group] + 1 > group_values[greater_group]:
+                group_values[greater_group] = group_values[group] + 1
+            remaining_below[greater_group] = remaining_below[greater_group] - 1
+            if remaining_below[greater_group] == 0:
+                ready_groups.append(greater_group)
+    
+    if finished_count < len(all_groups):
+        return None
+    
+    f_values = [group_values[find_group(group_parents, symbol_id)] for symbol_id in range(symbol_count)]
+    g_values = [group_values[find_group(group_parents, symbol_count + symbol_id)] for symbol_id in range(symbol_count)]
+    return PrecedenceFunctions(compiled_grammar, f_values, g_values, precedence_matrix)
+
+
+def find_group(group_parents, node):
+    while group_parents[node] != node:
+        group_parents[node] = group_parents[group_parents[node]]
+        node = group_parents[node]
+    return node
 
 
 def build_precedence_table(grammar):
@@ -73,91 +331,78 @@ def add_start_end_relations(grammar, leading_sets, trailing_sets, precedence_rel
 
 
 def compute_leading_sets(grammar):
-    leading_sets = {}
-    
-    for nonterminal in grammar.non_terminal_symbols:
-        leading_sets[nonterminal] = []
-    
-    add_direct_leading_terminals(grammar, leading_sets)
-    propagate_leading_sets(grammar, leading_sets)
-    
-    return leading_sets
+    compiled_grammar = compile_grammar(grammar)
+    return bitsets_to_terminal_lists(compiled_grammar, compute_leading_bitsets(compiled_grammar))
 
 
-def add_direct_leading_terminals(grammar, leading_sets):
-    for production in grammar.production_list:
-        if len(production.right_side) > 0:
-            first_symbol = production.right_side[0]
-            
-            if is_terminal_symbol(first_symbol, grammar):
-                if first_symbol not in leading_sets[production.left_side]:
-                    leading_sets[production.left_side].append(first_symbol)
-            
-            if len(production.right_side) > 1:
-                first_is_nonterminal = is_nonterminal_symbol(first_symbol, grammar)
-                second_is_terminal = is_terminal_symbol(production.right_side[1], grammar)
-                if first_is_nonterminal and second_is_terminal:
-                    second_symbol = production.right_side[1]
-                    if second_symbol not in leading_sets[production.left_side]:
-                        leading_sets[production.left_side].append(second_symbol)
-
-
-def _propagate_sets(grammar, sets_dict, get_symbol_func):
-    something_changed = True
-    while something_changed:
-        something_changed = False
-        
-        for production in grammar.production_list:
-            if len(production.right_side) > 0:
-                symbol = get_symbol_func(production.right_side)
-                if is_nonterminal_symbol(symbol, grammar):
-                    old_count = len(sets_dict[production.left_side])
-                    
-                    for terminal in sets_dict[symbol]:
-                        if terminal not in sets_dict[production.left_side]:
-                            sets_dict[production.left_side].append(terminal)
-                    
-                    new_count = len(sets_dict[production.left_side])
-                    if new_count > old_count:
-                        something_changed = True
+def compute_trailing_sets(grammar):
+    compiled_grammar = compile_grammar(grammar)
+    return bitsets_to_terminal_lists(compiled_grammar, compute_trailing_bitsets(compiled_grammar))
 
 
-def propagate_leading_sets(grammar, leading_sets):
-    _propagate_sets(grammar, leading_sets, lambda right_side: right_side[0])
+def compute_leading_bitsets(grammar):
+    return compute_edge_terminal_bitsets(grammar, lambda right_side: right_side[:2])
 
 
-def compute_trailing_sets(grammar):
-    trailing_sets = {}
+def compute_trailing_bitsets(grammar):
+    return compute_edge_terminal_bitsets(grammar, lambda right_side: right_side[:-3:-1])
+
+
+def compute_edge_terminal_bitsets(grammar, get_edge_symbols):
+    # Bit i of a set stands for the terminal with symbol id i. get_edge_symbols returns the first two
+    # symbols of a right side read from the edge inwards (left edge for LEADING, right for TRAILING).
+    compiled_grammar = compile_grammar(grammar)
+    terminal_bitsets = {}
+    dependent_symbols = {}
     
-    for nonterminal in grammar.non_terminal_symbols:
-        trailing_sets[nonterminal] = []
+    for nonterminal in compiled_grammar.non_terminal_symbols:
+        terminal_bitsets[nonterminal] = 0
+        dependent_symbols[nonterminal] = []
     
-    add_direct_trailing_terminals(grammar, trailing_sets)
-    propagate_trailing_sets(grammar, trailing_sets)
+    for production in compiled_grammar.production_list:
+        edge_symbols = get_edge_symbols(production.right_side)
+        if len(edge_symbols) == 0:
+            continue
+        
+        edge_symbol = edge_symbols[0]
+        if compiled_grammar.is_terminal(edge_symbol):
+            terminal_bitsets[production.left_side] |= 1 << compiled_grammar.get_symbol_id(edge_symbol)
+        elif compiled_grammar.is_nonterminal(edge_symbol):
+            if len(edge_symbols) > 1 and compiled_grammar.is_terminal(edge_symbols[1]):
+                terminal_bitsets[production.left_side] |= 1 << compiled_grammar.get_symbol_id(edge_symbols[1])
+            # Everything the edge non-terminal can start (or end) with flows into the left side
+            if production.left_side != edge_symbol:
+                dependent_symbols[edge_symbol].append(production.left_side)
     
-    return trailing_sets
-
-
-def add_direct_trailing_terminals(grammar, trailing_sets):
-    for production in grammar.production_list:
-        if len(production.right_side) > 0:
-            last_symbol = production.right_side[-1]
-            
-            if is_terminal_symbol(last_symbol, grammar):
-                if last_symbol not in trailing_sets[production.left_side]:
-                    trailing_sets[production.left_side].append(last_symbol)
-            
-            if len(production.right_side) > 1:
-                last_is_nonterminal = is_nonterminal_symbol(last_symbol, grammar)
-                second_last_is_terminal = is_terminal_symbol(production.right_side[-2], grammar)
-                if last_is_nonterminal and second_last_is_terminal:
-                    second_last_symbol = production.right_side[-2]
-                    if second_last_symbol not in trailing_sets[production.left_side]:
-                        trailing_sets[production.left_side].append(second_last_symbol)
+    # Worklist propagation: a symbol is revisited only when its set actually grew, and every merge
+    # is a single integer OR, so each edge is walked at most once per newly added terminal
+    pending_symbols = [symbol for symbol in terminal_bitsets if terminal_bitsets[symbol] != 0]
+    while len(pending_symbols) > 0:
+        symbol = pending_symbols.pop()
+        symbol_bitset = terminal_bitsets[symbol]
+        
+        for dependent_symbol in dependent_symbols[symbol]:
+            merged_bitset = terminal_bitsets[dependent_symbol] | symbol_bitset
+            if merged_bitset != terminal_bitsets[dependent_symbol]:
+                terminal_bitsets[dependent_symbol] = merged_bitset
+                pending_symbols.append(dependent_symbol)
+    
+    return terminal_bitsets
 
 
-def propagate_trailing_sets(grammar, trailing_sets):
-    _propagate_sets(grammar, trailing_sets, lambda right_side: right_side[-1])
+def bitsets_to_terminal_lists(compiled_grammar, terminal_bitsets):
+    terminal_lists = {}
+    
+    for nonterminal in terminal_bitsets:
+        terminals = []
+        remaining_bits = terminal_bitsets[nonterminal]
+        while remaining_bits != 0:
+            lowest_bit = remaining_bits & -remaining_bits
+            terminals.append(compiled_grammar.get_symbol_name(lowest_bit.bit_length() - 1))
+            remaining_bits = remaining_bits ^ lowest_bit
+        terminal_lists[nonterminal] = terminals
+    
+    return terminal_lists
 
 
 def set_precedence_relation(symbol_a, symbol_b, relation_type, precedence_relations):
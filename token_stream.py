@@ -0,0 +1,173 @@
+import mmap
+import re
+from array import array
+from parsing_core import compile_grammar, build_terminal_trie, trie_to_pattern
+
+
+# Bytes patterns only know ASCII whitespace, so the UTF-8 forms of every other character that
+# str patterns and str.split() treat as whitespace are spelled out: U+001C-U+001F, U+0085,
+# U+00A0, U+1680, U+2000-U+200A, U+2028, U+2029, U+202F, U+205F and U+3000
+UTF8_WHITESPACE_PATTERN = rb"[\x1c-\x1f]|\xc2[\x85\xa0]|\xe1\x9a\x80|\xe2\x80[\x80-\x8a\xa8\xa9\xaf]|\xe2\x81\x9f|\xe3\x80\x80"
+# A source without any of these bytes has ASCII whitespace only and takes the faster patterns
+UTF8_WHITESPACE_BYTES = re.compile(rb"[\x1c-\x1f\xc2\xe1-\xe3]")
+
+# Any non-whitespace character that starts no terminal becomes a token of its own, keeping
+# multi-byte UTF-8 characters in one piece
+UNKNOWN_TOKEN_PATTERN = rb"[\xc0-\xff][\x80-\xbf]*|\S"
+# The same with UTF-8 whitespace skipped. The lexer steps over a skipped character one byte at a
+# time, so continuation bytes right after a lead byte are never a token; only a stray one
+# (invalid UTF-8) is
+UTF8_UNKNOWN_TOKEN_PATTERN = (rb"(?!" + UTF8_WHITESPACE_PATTERN + rb")"
+                              rb"(?:[\xc0-\xff][\x80-\xbf]*|[^\s\x80-\xbf]|(?<![\xc0-\xff])(?<![\xe0-\xff][\x80-\xbf])[\x80-\xbf])")
+
+# Indexed by whether the source has UTF-8 whitespace
+CHARACTER_TOKEN_PATTERNS = (re.compile(UNKNOWN_TOKEN_PATTERN), re.compile(UTF8_UNKNOWN_TOKEN_PATTERN))
+WORD_TOKEN_PATTERNS = (re.compile(rb"\S+"), re.compile(rb"(?:" + UTF8_UNKNOWN_TOKEN_PATTERN + rb")+"))
+
+
+class BinaryLexer:
+    def __init__(self, terminal_patterns, lexeme_ids):
+        # Indexed like CHARACTER_TOKEN_PATTERNS
+        self.terminal_patterns = terminal_patterns
+        self.lexeme_ids = lexeme_ids
+
+
+class TokenStream:
+    # Tokens of a memory-mapped source as three array columns: terminal symbol id (-1 for
+    # anything that is not a terminal) and the byte offsets of the lexeme. Indexing gives the
+    # grammar's own terminal string, so only unknown lexemes are ever copied out of the source.
+    # Use it as a context manager, or call close(), to release the memory map.
+    def __init__(self, compiled_grammar, source_bytes, token_ids, start_offsets, end_offsets):
+        self.compiled_grammar = compiled_grammar
+        self.source_bytes = source_bytes
+        self.token_ids = token_ids
+        self.start_offsets = start_offsets
+        self.end_offsets = end_offsets
+        self.unknown_lexemes = None  # Token index -> lexeme, filled in by close
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exception_type, exception_value, traceback):
+        self.close()
+        return False
+    
+    def __len__(self):
+        return len(self.token_ids)
+    
+    def __getitem__(self, token_index):
+        if isinstance(token_index, slice):
+            return [self[index] for index in range(*token_index.indices(len(self.token_ids)))]
+        
+        token_id = self.token_ids[token_index]
+        if token_id >= 0:
+            return self.compiled_grammar.symbol_names[token_id]
+        return self.lexeme(token_index)
+    
+    def __iter__(self):
+        for token_index in range(len(self.token_ids)):
+            yield self[token_index]
+    
+    def lexeme(self, token_index):
+        if self.unknown_lexemes is not None:
+            token_id = self.token_ids[token_index]
+            if token_id >= 0:
+                return self.compiled_grammar.symbol_names[token_id]
+            return self.unknown_lexemes[token_index]
+        return self.source_bytes[self.start_offsets[token_index]:self.end_offsets[token_index]].decode("utf-8", "replace")
+    
+    def close(self):
+        # The few unknown lexemes are copied out first, so the stream still indexes after the map
+        # is gone and the steps of a finished parse can still be rendered
+        if isinstance(self.source_bytes, mmap.mmap) and not self.source_bytes.closed:
+            unknown_lexemes = {}
+            for token_index, token_id in enumerate(self.token_ids):
+                if token_id < 0:
+                    unknown_lexemes[token_index] = self.lexeme(token_index)
+            self.source_bytes.close()
+            self.unknown_lexemes = unknown_lexemes
+
+
+def get_token_ids(input_tokens, compiled_grammar):
+    # The id column of a TokenStream lexed for this grammar is used as it is; any other sequence
+    # of token strings is looked up once, with -1 for tokens that are not symbols of the grammar
+    if isinstance(input_tokens, TokenStream) and input_tokens.compiled_grammar is compiled_grammar:
+        return input_tokens.token_ids
+    symbol_ids = compiled_grammar.symbol_ids
+    return [symbol_ids.get(token, -1) for token in input_tokens]
+
+
+def get_binary_lexer(grammar):
+    compiled_grammar = compile_grammar(grammar)
+    if compiled_grammar.binary_lexer is None:
+        # The terminal trie is built over UTF-8 bytes: latin-1 maps every byte to one character,
+        # so the str pattern encodes back to the matching bytes pattern
+        byte_terminals = [terminal.encode("utf-8").decode("latin-1") for terminal in compiled_grammar.terminal_symbols]
+        terminal_pattern = trie_to_pattern(build_terminal_trie(byte_terminals)).encode("latin-1")
+        terminal_patterns = []
+        for unknown_token_pattern in (UNKNOWN_TOKEN_PATTERN, UTF8_UNKNOWN_TOKEN_PATTERN):
+            if terminal_pattern == b"":
+                terminal_patterns.append(re.compile(unknown_token_pattern))
+            else:
+                terminal_patterns.append(re.compile(terminal_pattern + b"|" + unknown_token_pattern))
+        
+        lexeme_ids = {}
+        for terminal in compiled_grammar.terminal_symbols:
+            lexeme_ids.setdefault(terminal.encode("utf-8"), compiled_grammar.get_symbol_id(terminal))
+        
+        compiled_grammar.binary_lexer = BinaryLexer(tuple(terminal_patterns), lexeme_ids)
+    return compiled_grammar.binary_lexer
+
+
+def open_token_stream(file_path, grammar, split_on_whitespace=False):
+    # By default the source is lexed like tokenize_with_grammar_terminals (longest terminal match);
+    # split_on_whitespace=True takes every whitespace-separated word as one token instead.
+    # split_on_whitespace=None follows tokenize_input_string: words when the source has a space,
+    # otherwise one token per character (line breaks are skipped rather than made tokens)
+    compiled_grammar = compile_grammar(grammar)
+    binary_lexer = get_binary_lexer(compiled_grammar)
+    
+    source_file = open(file_path, "rb")
+    try:
+        # An empty file cannot be mapped
+        if source_file.seek(0, 2) == 0:
+            source_bytes = b""
+        else:
+            source_bytes = mmap.mmap(source_file.fileno(), 0, access=mmap.ACCESS_READ)
+    finally:
+        source_file.close()
+    
+    return tokenize_source_bytes(compiled_grammar, source_bytes, binary_lexer, split_on_whitespace)
+
+
+def tokenize_source_bytes(compiled_grammar, source_bytes, binary_lexer, split_on_whitespace):
+    has_utf8_whitespace = int(UTF8_WHITESPACE_BYTES.search(source_bytes) is not None)
+    if split_on_whitespace is None:
+        if source_bytes.find(b" ") >= 0:
+            token_pattern = WORD_TOKEN_PATTERNS[has_utf8_whitespace]
+        else:
+            token_pattern = CHARACTER_TOKEN_PATTERNS[has_utf8_whitespace]
+    elif split_on_whitespace:
+        token_pattern = WORD_TOKEN_PATTERNS[has_utf8_whitespace]
+    else:
+        token_pattern = binary_lexer.terminal_patterns[has_utf8_whitespace]
+    
+    # The narrowest item sizes that fit this grammar and this source
+    if len(compiled_grammar.symbol_names) < 2 ** 15:
+        token_ids = array("h")
+    else:
+        token_ids = array("i")
+    if len(source_bytes) < 2 ** 32:
+        start_offsets = array("I")
+        end_offsets = array("I")
+    else:
+        start_offsets = array("Q")
+        end_offsets = array("Q")
+    
+    lexeme_ids = binary_lexer.lexeme_ids
+    for token_match in token_pattern.finditer(source_bytes):
+        token_ids.append(lexeme_ids.get(token_match.group(), -1))
+        start_offsets.append(token_match.start())
+        end_offsets.append(token_match.end())
+    
+    return TokenStream(compiled_grammar, source_bytes, token_ids, start_offsets, end_offsets)
@@ -0,0 +1,170 @@
+from array import array
+from parsing_core import compile_grammar, TreeNode
+
+
+TREE_OBJECTS = "objects"
+TREE_ARENA = "arena"
+
+# Arena symbol id of "ε" leaves, which are not grammar symbols
+EPSILON_SYMBOL_ID = -2
+
+
+class TreeArena:
+    # Parse tree nodes as parallel arrays; a node is its index, children are linked through
+    # first_child/next_sibling and -1 stands for none
+    def __init__(self, compiled_grammar):
+        self.compiled_grammar = compiled_grammar
+        self.symbol_ids = array("i")
+        self.first_children = array("i")
+        self.next_siblings = array("i")
+        self.span_starts = array("i")
+        self.span_ends = array("i")
+    
+    def __len__(self):
+        return len(self.symbol_ids)
+    
+    def add_node(self, symbol_id, span_start, span_end, first_child=-1):
+        self.symbol_ids.append(symbol_id)
+        self.first_children.append(first_child)
+        self.next_siblings.append(-1)
+        self.span_starts.append(span_start)
+        self.span_ends.append(span_end)
+        return len(self.symbol_ids) - 1
+    
+    def mark(self):
+        return len(self.symbol_ids)
+    
+    def rollback(self, arena_mark):
+        del self.symbol_ids[arena_mark:]
+        del self.first_children[arena_mark:]
+        del self.next_siblings[arena_mark:]
+        del self.span_starts[arena_mark:]
+        del self.span_ends[arena_mark:]
+    
+    def get_symbol(self, node_index):
+        symbol_id = self.symbol_ids[node_index]
+        if symbol_id == EPSILON_SYMBOL_ID:
+            return "ε"
+        return self.compiled_grammar.get_symbol_name(symbol_id)
+    
+    def get_children(self, node_index):
+        child_indexes = []
+        child_index = self.first_children[node_index]
+        while child_index >= 0:
+            child_indexes.append(child_index)
+            child_index = self.next_siblings[child_index]
+        return child_indexes
+
+
+class TreeNodeView:
+    # TreeNode API over one arena node for code such as gui.py; child views are created on first
+    # access and kept, so x/y set while laying out the tree stay put
+    __slots__ = ("arena", "node_index", "child_views", "x", "y")
+    
+    def __init__(self, arena, node_index):
+        self.arena = arena
+        self.node_index = node_index
+        self.child_views = None
+        self.x = 0
+        self.y = 0
+    
+    @property
+    def symbol(self):
+        return self.arena.get_symbol(self.node_index)
+    
+    @property
+    def span(self):
+        return (self.arena.span_starts[self.node_index], self.arena.span_ends[self.node_index])
+    
+    @property
+    def children(self):
+        if self.child_views is None:
+            self.child_views = [TreeNodeView(self.arena, child_index) for child_index in self.arena.get_children(self.node_index)]
+        return self.child_views
+    
+    def add_child(self, child):
+        # child is a view on the same arena
+        child_indexes = self.arena.get_children(self.node_index)
+        if len(child_indexes) == 0:
+            self.arena.first_children[self.node_index] = child.node_index
+        else:
+            self.arena.next_siblings[child_indexes[-1]] = child.node_index
+        if self.child_views is not None:
+            self.child_views.append(child)
+    
+    def is_leaf(self):
+        return self.arena.first_children[self.node_index] < 0
+
+
+class ObjectTreeBuilder:
+    # Builds TreeNode objects; marks and rollbacks are free because discarded nodes are just dropped
+    def reset(self):
+        pass
+    
+    def make_leaf(self, symbol, position):
+        return TreeNode(symbol)
+    
+    def make_epsilon(self, position):
+        return TreeNode("ε")
+    
+    def make_node(self, symbol, children_nodes, span_start, span_end):
+        return TreeNode(symbol, children_nodes)
+    
+    def reuse_node(self, tree_node):
+        return tree_node
+    
+    def mark(self):
+        return 0
+    
+    def rollback(self, tree_mark):
+        pass
+    
+    def get_tree(self, tree_node):
+        return tree_node
+
+
+class ArenaTreeBuilder:
+    # Builds nodes in a TreeArena; a failed alternative rolls the arena back to its mark
+    def __init__(self, grammar):
+        self.compiled_grammar = compile_grammar(grammar)
+        self.arena = TreeArena(self.compiled_grammar)
+    
+    def reset(self):
+        self.arena = TreeArena(self.compiled_grammar)
+    
+    def make_leaf(self, symbol, position):
+        return self.arena.add_node(self.compiled_grammar.get_symbol_id(symbol), position, position + 1)
+    
+    def make_epsilon(self, position):
+        return self.arena.add_node(EPSILON_SYMBOL_ID, position, position)
+    
+    def make_node(self, symbol, children_nodes, span_start, span_end):
+        first_child = -1
+        if len(children_nodes) > 0:
+            first_child = children_nodes[0]
+            for child_number in range(len(children_nodes) - 1):
+                self.arena.next_siblings[children_nodes[child_number]] = children_nodes[child_number + 1]
+        return self.arena.add_node(self.compiled_grammar.get_symbol_id(symbol), span_start, span_end, first_child)
+    
+    def reuse_node(self, node_index):
+        # A node reused from a memo may already be linked into another child list, so the copy
+        # gets its own sibling link while sharing the subtree below
+        arena = self.arena
+        return arena.add_node(arena.symbol_ids[node_index], arena.span_starts[node_index], arena.span_ends[node_index], arena.first_children[node_index])
+    
+    def mark(self):
+        return self.arena.mark()
+    
+    def rollback(self, tree_mark):
+        self.arena.rollback(tree_mark)
+    
+    def get_tree(self, node_index):
+        return TreeNodeView(self.arena, node_index)
+
+
+def create_tree_builder(grammar, tree_store):
+    if tree_store == TREE_OBJECTS:
+        return ObjectTreeBuilder()
+    if tree_store == TREE_ARENA:
+        return ArenaTreeBuilder(grammar)
+    raise Exception("Unknown tree store: " + str(tree_store))